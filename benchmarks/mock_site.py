@@ -0,0 +1,249 @@
+"""Local HTTP server shaped like the supported manga sites.
+
+Usage: python benchmarks/mock_site.py [port]
+
+Serves a comic named 'kingdom' in the url layout of each extractor
+(see MockSite.comic_url), with optional latency, bandwidth limit and
+injected errors, so the real pipelines can run without network access.
+The server must be reached as 'localhost': the mangareader extractor
+takes the first '/<digits>' of a url as the chapter number, so a
+numeric host (127.0.0.1) breaks it.
+"""
+import io
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Comic url of each site shape (relative to the server)
+COMIC_PATHS = {
+    'mangafox': '/mangafox/manga/kingdom/',
+    'mangahere': '/mangahere/manga/kingdom/',
+    'mangareader': '/mangareader/kingdom',
+    'mangastream': '/readms/manga/kingdom',
+}
+# Site chrome around the page image (scripts, menus, ads)
+FILLER = ('<div class="ad-slot"><script type="text/javascript">'
+          'window.ads = window.ads || []; ads.push({slot: "%d"});'
+          '</script><a href="/manga/other-%d/">Other manga %d</a></div>\n')
+
+
+def make_image(width, height, seed=0):
+    """A poorly compressible JPEG page of width x height."""
+    from PIL import Image
+    noise = random.Random(seed)
+    data = bytes(noise.getrandbits(8) for _ in range(width * height))
+    buf = io.BytesIO()
+    Image.frombytes('L', (width, height), data).convert('RGB').save(
+        buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+class MockSite:
+    """A threaded mock site, served in the background once started.
+
+    latency: seconds before each response.
+    bandwidth: bytes per second of each response body (None: no limit).
+    error_rate: share of page and image requests answered with a 503.
+    """
+
+    def __init__(self, chapters=5, pages=20, latency=0, bandwidth=None,
+                 error_rate=0, image_size=(800, 1200), html_size=50000,
+                 port=0):
+        """Build the responses; the server starts with start()."""
+        self.chapters = chapters
+        self.pages = pages
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.image = make_image(*image_size)
+        self.filler = ''.join(FILLER % (i, i, i) for i in range(
+            html_size // len(FILLER % (0, 0, 0)) + 1))[:html_size]
+        self.lock = threading.Lock()
+        self.reset()
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                site.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('localhost', port), Handler)
+        self.port = self.server.server_address[1]
+        self.routes = [
+            (re.compile(r'/img/(\w+)/(\d+)/(\d+)\.jpg$'), self.image_page),
+            (re.compile(r'/mangafox/manga/kingdom/?$'), self.fox_index),
+            (re.compile(r'/mangafox/manga/kingdom/c(\d+)/(\d+)\.html$'),
+             self.fox_page),
+            (re.compile(r'/mangahere/manga/kingdom/?$'), self.here_index),
+            (re.compile(r'/mangahere/manga/kingdom/c(\d+)(?:/(\d+)\.html)?$'),
+             self.here_page),
+            (re.compile(r'/mangareader/kingdom/?$'), self.reader_index),
+            (re.compile(r'/mangareader/kingdom/(\d+)(?:/(\d+))?$'),
+             self.reader_page),
+            (re.compile(r'/readms/manga/kingdom/?$'), self.stream_index),
+            (re.compile(r'/readms/r/kingdom/(\d+)/\d+/(\d+)$'),
+             self.stream_page),
+        ]
+
+    def comic_url(self, site):
+        """Url of the comic in the layout of site."""
+        return 'http://localhost:%d%s' % (self.port, COMIC_PATHS[site])
+
+    def start(self):
+        """Serve in a background thread."""
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        """Zero the served counters."""
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.images = 0
+            self.bytes = 0
+
+    def handle(self, request):
+        """Answer a GET request."""
+        time.sleep(self.latency)
+        for pattern, route in self.routes:
+            match = pattern.match(request.path)
+            if match:
+                break
+        else:
+            return self.send(request, 404, b'')
+
+        # Indexes never fail, so each run gets to its pages
+        if not route.__name__.endswith('index') and \
+                random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return self.send(request, 503, b'')
+
+        body = route(*match.groups())
+        content_type = 'image/jpeg' if isinstance(body, bytes) \
+            else 'text/html; charset=utf-8'
+        if not isinstance(body, bytes):
+            body = body.encode()
+        self.send(request, 200, body, content_type)
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(body)
+            self.images += content_type == 'image/jpeg'
+
+    def send(self, request, status, body, content_type='text/html'):
+        """Send a response, throttled to the bandwidth."""
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        if not self.bandwidth:
+            request.wfile.write(body)
+            return
+        chunk = max(1, int(self.bandwidth / 100))
+        for start in range(0, len(body), chunk):
+            request.wfile.write(body[start:start + chunk])
+            time.sleep(len(body[start:start + chunk]) / self.bandwidth)
+
+    def html(self, body):
+        """Wrap a page body in the site chrome."""
+        return '<html><head><title>kingdom</title></head><body>%s%s' \
+            '</body></html>' % (body, self.filler)
+
+    def image_url(self, site, chapter, page):
+        """Absolute url of a page image."""
+        return 'http://localhost:%d/img/%s/%s/%s.jpg' % (
+            self.port, site, chapter, page)
+
+    def image_page(self, site, chapter, page):
+        """The page image (the same for every page)."""
+        return self.image
+
+    def fox_index(self):
+        """Chapter list of mangafox."""
+        return self.html(''.join(
+            '<a href="/mangafox/manga/kingdom/c%03d/1.html">Kingdom %d</a>'
+            % (i, i) for i in range(1, self.chapters + 1)))
+
+    def fox_page(self, chapter, page):
+        """Page of mangafox: page count in JS, <img id="image">."""
+        return self.html(
+            '<script type="text/javascript">var total_pages = %d;</script>'
+            '<img id="image" src="%s" alt="kingdom">'
+            % (self.pages, self.image_url('mangafox', chapter, page)))
+
+    def here_index(self):
+        """Chapter list of mangahere."""
+        return self.html(''.join(
+            '<a href="/mangahere/manga/kingdom/c%03d/">Kingdom %d</a>'
+            % (i, i) for i in range(1, self.chapters + 1)))
+
+    def here_page(self, chapter, page):
+        """Page of mangahere (the chapter url is its first page)."""
+        return self.html(
+            '<script type="text/javascript">var total_pages = %d;</script>'
+            '<img id="image" src="%s" alt="kingdom">'
+            % (self.pages, self.image_url('mangahere', chapter, page or 1)))
+
+    def reader_index(self):
+        """Chapter list of mangareader."""
+        return self.html(''.join(
+            '<a href="/mangareader/kingdom/%d">Kingdom %d</a>'
+            % (i, i) for i in range(1, self.chapters + 1)))
+
+    def reader_page(self, chapter, page):
+        """Page of mangareader: page menu, image in div#imgholder."""
+        options = ''.join(
+            '<option value="/mangareader/kingdom/%s/%d">%d</option>'
+            % (chapter, i, i) for i in range(1, self.pages + 1))
+        return self.html(
+            '<select name="pageMenu">%s</select>'
+            '<div id="imgholder"><img src="/img/mangareader/%s/%s.jpg">'
+            '</div>' % (options, chapter, page or 1))
+
+    def stream_index(self):
+        """Chapter table of mangastream."""
+        return self.html('<table>%s</table>' % ''.join(
+            '<tr><td><a href="/readms/r/kingdom/%03d/%d/1">Kingdom %d</a>'
+            '</td></tr>' % (i, 1000 + i, i)
+            for i in range(1, self.chapters + 1)))
+
+    def stream_page(self, chapter, page):
+        """Page of mangastream: page dropdown, image in div.page."""
+        items = ''.join(
+            '<li><a href="/readms/r/kingdom/%s/%d/%d">Page %d</a></li>'
+            % (chapter, 1000 + int(chapter), i, i)
+            for i in range(1, self.pages + 1))
+        return self.html(
+            '<ul class="dropdown-menu">%s</ul>'
+            '<div class="page"><a href="#"><img src="/img/mangastream/%s/%s'
+            '.jpg"></a></div>' % (items, chapter, page))
+
+
+def main():
+    """Serve until interrupted."""
+    site = MockSite(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    for name in sorted(COMIC_PATHS):
+        print('%-12s %s' % (name, site.comic_url(name)))
+    site.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Micro-benchmark of the per-page image lookup of each extractor.
+
+Usage: python benchmarks/parse_pages.py [repeats]
+
+Times finding the page image in the saved fixture pages with the old
+full html.parser soup, a full soup of the fastest available parser, the
+strained soup fallback and the regex fast path.
+"""
+import os
+import sys
+import timeit
+import bs4 as bsoup
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from comic_scraper.parsers import (  # noqa: E402
+    PARSER, make_soup, find_image_src)
+from comic_scraper.extractors import (  # noqa: E402
+    mangafox, mangahere, mangareader, mangastream)
+
+
+def find_by_id(soup):
+    """Image lookup of mangafox and mangahere."""
+    return soup.find_all('img', attrs={'id': 'image'})[0].get('src')
+
+
+def find_in_imgholder(soup):
+    """Image lookup of mangareader."""
+    for div in soup.find_all('div', {'id': 'imgholder'}):
+        return div.find_all('img')[0].get('src')
+
+
+def find_in_page_div(soup):
+    """Image lookup of mangastream."""
+    for div in soup.find_all('div'):
+        if div.get('class') and div.get('class')[0] == 'page':
+            return div.find_all('img')[0].get('src')
+
+
+# site: (fast path, strainer of the fallback, soup lookup)
+SITES = {
+    'mangafox': (mangafox.IMAGE_TAG, bsoup.SoupStrainer('img'), find_by_id),
+    'mangahere': (mangahere.IMAGE_TAG, bsoup.SoupStrainer('img'),
+                  find_by_id),
+    'mangareader': (mangareader.IMAGE_TAG,
+                    bsoup.SoupStrainer('div', id='imgholder'),
+                    find_in_imgholder),
+    'mangastream': (mangastream.IMAGE_TAG, bsoup.SoupStrainer('div'),
+                    find_in_page_div),
+}
+
+
+def main():
+    """Time every lookup strategy on every fixture page."""
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    strategies = ['html.parser', PARSER, PARSER + ' strained', 'fast path']
+    print('ms per page (%d repeats), fast parser: %s' % (repeats, PARSER))
+    print('%-12s' % 'site' + ''.join('%18s' % name for name in strategies))
+
+    for site, (pattern, strainer, lookup) in sorted(SITES.items()):
+        with open(os.path.join(HERE, 'fixtures', site + '_page.html')) as f:
+            html = f.read()
+        runs = [
+            lambda: lookup(bsoup.BeautifulSoup(html, 'html.parser')),
+            lambda: lookup(make_soup(html)),
+            lambda: lookup(make_soup(html, strainer)),
+            lambda: find_image_src(html, pattern),
+        ]
+        # All strategies must agree on the image
+        assert len(set(run() for run in runs)) == 1, site
+        times = [timeit.timeit(run, number=repeats) / repeats * 1000
+                 for run in runs]
+        print('%-12s' % site + ''.join('%18.3f' % t for t in times))
+
+
+if __name__ == '__main__':
+    main()
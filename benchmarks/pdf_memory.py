@@ -0,0 +1,81 @@
+"""Compare peak RSS and wall time of PDF building strategies.
+
+Usage: python benchmarks/pdf_memory.py [pages] [width] [height]
+
+Generates a chapter of noisy (poorly compressible) JPEG scans and packs
+it once with the old in-memory conversion and once with pdfdir, each in
+a fresh interpreter so the peak RSS of one does not hide the other.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+
+
+def make_chapter(folder, pages, width, height):
+    """Write noisy JPEG pages to folder."""
+    from PIL import Image
+    for page_num in range(1, pages + 1):
+        image = Image.frombytes('RGB', (width, height),
+                                os.urandom(width * height * 3))
+        image.save(os.path.join(folder, '%0.3d.jpg' % page_num), quality=90)
+
+
+def pack_in_memory(folder, filename):
+    """Pack the way pdfdir used to: the whole PDF as one bytes object."""
+    import img2pdf
+    with open(filename, "wb") as f:
+        f.write(img2pdf.convert(
+            [os.path.join(folder, fn) for fn in sorted(os.listdir(folder))]))
+
+
+def pack_streaming(folder, filename):
+    """Pack with the current pdfdir."""
+    from comic_scraper.base_comic import pdfdir
+    pdfdir(folder, filename)
+
+
+def run(strategy, folder, filename):
+    """Pack once and print wall time and peak RSS (in MB)."""
+    start = time.perf_counter()
+    globals()['pack_' + strategy](folder, filename)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('%.3f %.1f' % (elapsed, peak))
+
+
+def main():
+    """Build a chapter and compare the strategies."""
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1600
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 2400
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, 'chapter')
+        os.makedirs(folder)
+        make_chapter(folder, pages, width, height)
+        size = sum(os.path.getsize(os.path.join(folder, fn))
+                   for fn in os.listdir(folder)) / 2 ** 20
+        print('%d pages of %dx%d, %.1f MB of JPEG'
+              % (pages, width, height, size))
+        print('%-10s %10s %14s' % ('strategy', 'wall (s)', 'peak RSS (MB)'))
+
+        for strategy in ('in_memory', 'streaming'):
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--run', strategy, folder,
+                 os.path.join(tmp, strategy + '.pdf')])
+            elapsed, peak = output.split()
+            print('%-10s %10s %14s' % (strategy, elapsed.decode(),
+                                       peak.decode()))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(*sys.argv[2:5])
+    else:
+        main()
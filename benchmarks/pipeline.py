@@ -0,0 +1,106 @@
+"""End-to-end benchmark of the download pipelines against a mock site.
+
+Usage: python benchmarks/pipeline.py [options] [-- comic-scraper options]
+
+Serves every site shape with benchmarks/mock_site.py and downloads the
+comic once per site with the real comic-scraper, in a fresh interpreter
+per run so peak RSS and CPU time belong to that run alone. Reports
+pages/s, MB/s, peak RSS and CPU time. Options after '--' are passed to
+comic-scraper (e.g. -- -ct 4 -pt 8 -f cbz -e async).
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.insert(0, HERE)
+
+from mock_site import MockSite, COMIC_PATHS  # noqa: E402
+
+
+def run(url, location, *options):
+    """Download a comic and print wall time, CPU time and peak RSS."""
+    sys.path.insert(0, ROOT)
+    sys.argv = ['comic-scraper', '-l', location] + list(options) + [url]
+    from comic_scraper import comic_scraper
+
+    # Keep the pipeline's own output out of the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.perf_counter()
+    try:
+        comic_scraper.main()
+    finally:
+        sys.stdout = stdout
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # Worker processes (transforms, conversions) count towards CPU
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    print('%.3f %.3f %.1f' % (elapsed, usage.ru_utime + usage.ru_stime +
+                              children.ru_utime + children.ru_stime,
+                              usage.ru_maxrss / 1024))
+
+
+def main():
+    """Run every site shape and report."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipelines against a local mock site.')
+    parser.add_argument('--sites', nargs='+', default=sorted(COMIC_PATHS),
+                        choices=sorted(COMIC_PATHS))
+    parser.add_argument('--chapters', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=20,
+                        help='Milliseconds before each response.')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='KB/s of each response (default: no limit).')
+    parser.add_argument('--errors', type=float, default=0,
+                        help='Share of page/image requests failing (503).')
+    parser.add_argument('--image', default='800x1200',
+                        help='Page image size, WIDTHxHEIGHT.')
+    argv = sys.argv[1:]
+    options = argv[argv.index('--') + 1:] if '--' in argv else []
+    args = parser.parse_args(argv[:argv.index('--')] if '--' in argv
+                             else argv)
+
+    site = MockSite(chapters=args.chapters, pages=args.pages,
+                    latency=args.latency / 1000,
+                    bandwidth=args.bandwidth * 1024 if args.bandwidth
+                    else None,
+                    error_rate=args.errors,
+                    image_size=[int(n) for n in args.image.split('x')])
+    site.start()
+    print('%d chapters x %d pages, %.0f KB images, %g ms latency, '
+          '%s KB/s, %g%% errors, options: %s'
+          % (args.chapters, args.pages, len(site.image) / 1024,
+             args.latency, args.bandwidth or 'unlimited',
+             args.errors * 100, ' '.join(options) or '(defaults)'))
+    print('%-12s %8s %8s %8s %8s %8s %10s'
+          % ('site', 'pages', 'wall (s)', 'pages/s', 'MB/s', 'CPU (s)',
+             'RSS (MB)'))
+
+    try:
+        for name in args.sites:
+            site.reset()
+            with tempfile.TemporaryDirectory() as location:
+                output = subprocess.check_output(
+                    [sys.executable, __file__, '--run',
+                     site.comic_url(name), location] + options)
+            elapsed, cpu, peak = [float(value)
+                                  for value in output.split()[-3:]]
+            print('%-12s %8d %8.2f %8.1f %8.2f %8.2f %10.1f'
+                  % (name, site.images, elapsed, site.images / elapsed,
+                     site.bytes / 2 ** 20 / elapsed, cpu, peak))
+    finally:
+        site.stop()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(*sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,78 @@
+"""Throughput and output size of the page transform.
+
+Usage: python benchmarks/transform.py [pages] [width] [height]
+
+Transforms a chapter of scan-like JPEG pages with a few settings, once
+page by page in this process and once on the process pool (as the
+download pipeline does), and reports pages/s and the output size.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), '..'))
+
+from comic_scraper.transform import (  # noqa: E402
+    Transform, transform_image)
+
+# name: (max_width, max_height, grayscale, quality)
+SETTINGS = [
+    ('e-ink 1072x1448 gray', (1072, 1448, True, 85)),
+    ('grayscale', (None, None, True, 85)),
+    ('re-encode q70', (None, None, False, 70)),
+]
+
+
+def make_page(width, height, seed):
+    """A scan-like page: paper texture, panel borders and text blocks."""
+    import io
+    from PIL import Image, ImageDraw
+    noise = random.Random(seed)
+    page = Image.effect_noise((width, height), 12).convert('RGB')
+    draw = ImageDraw.Draw(page)
+    for _ in range(6):
+        x, y = noise.randrange(width // 2), noise.randrange(height // 2)
+        draw.rectangle([x, y, x + width // 3, y + height // 4],
+                       outline=(20, 20, 20), width=6)
+        for line in range(8):
+            draw.line([x + 20, y + 30 + line * 25, x + width // 4,
+                       y + 30 + line * 25], fill=(40, 30, 30), width=8)
+    buf = io.BytesIO()
+    page.save(buf, 'JPEG', quality=92)
+    return buf.getvalue()
+
+
+def main():
+    """Transform the pages with every setting and report."""
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+
+    images = [make_page(width, height, seed) for seed in range(pages)]
+    size = sum(len(data) for data in images) / 2 ** 20
+    print('%d pages of %dx%d, %.1f MB of JPEG, %d cores'
+          % (pages, width, height, size, os.cpu_count()))
+    print('%-22s %14s %14s %12s' % ('setting', 'serial pages/s',
+                                    'pool pages/s', 'output (MB)'))
+
+    for name, options in SETTINGS:
+        start = time.perf_counter()
+        for data in images:
+            transform_image(data, 'jpeg', *options)
+        serial = pages / (time.perf_counter() - start)
+
+        transform = Transform(*options)
+        # Start the workers outside of the timing
+        transform.submit(images[0], 'jpeg').result()
+        start = time.perf_counter()
+        futures = [transform.submit(data, 'jpeg') for data in images]
+        output = sum(len(future.result()[0]) for future in futures)
+        pooled = pages / (time.perf_counter() - start)
+        print('%-22s %14.1f %14.1f %12.1f'
+              % (name, serial, pooled, output / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""Download comics and mangas as cbz (/pdf) files."""
+
+__all__ = ['Config', 'Comic', 'Chapter', 'Page', 'open_comic']
+
+
+def __getattr__(name):
+    """Load the library interface on first use (PEP 562).
+
+    Importing a submodule (e.g. current_comic) does not load the
+    extractors and their dependencies then.
+    """
+    if name in __all__:
+        from . import library
+        return getattr(library, name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
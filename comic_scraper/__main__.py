@@ -0,0 +1,4 @@
+"""Run the command line interface (python -m comic_scraper)."""
+from .comic_scraper import main
+
+main()
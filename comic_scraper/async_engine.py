@@ -0,0 +1,218 @@
+"""Asyncio download engine.
+
+Streams the images of every chapter of a comic on a single event loop
+with aiohttp (pip install comic-scraper[async]), so an image in flight
+costs a socket rather than a thread. At most inflight images are
+downloaded at once for the whole comic, and the host throttles of the
+thread engine (rate limit, adaptive limit, Retry-After) apply to them.
+
+The extractors stay blocking: page discovery, page html, saving pages
+and packing are run through an executor adapter on a pool of
+pagethreads threads. At most chapter_threads chapters are in progress;
+a chapter packed on the packer no longer counts as in progress.
+"""
+import asyncio
+import concurrent.futures
+import io
+import time
+from urllib.parse import urlparse
+import requests
+from requests.structures import CaseInsensitiveDict
+from .base_comic import CHUNK_SIZE, BadImageError, ShortBodyError, \
+    image_type
+from .metrics import METRICS
+from .throttle import host_throttle
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncEngine:
+    """Download the chapters of a comic on an event loop."""
+
+    def __init__(self, comic, inflight=None):
+        """Set the global number of images in flight."""
+        self.comic = comic
+        self.inflight = inflight or \
+            comic.chapter_threads * comic.page_threads
+
+    async def run(self):
+        """Download all chapters to download, return the packed ones."""
+        self.downloaded = []
+        self.packs = []
+        self.loop = asyncio.get_event_loop()
+        self.semaphore = asyncio.Semaphore(self.inflight)
+        connector = aiohttp.TCPConnector(
+            limit=self.inflight,
+            limit_per_host=self.comic.host_connections,
+            ssl=None if self.comic.session.verify else False)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.comic.page_threads) as self.executor:
+            async with aiohttp.ClientSession(
+                    connector=connector,
+                    headers=dict(self.comic.session.headers)) as self.http:
+                chapters = iter(self.comic.chapters_to_download.items())
+                await asyncio.gather(*[
+                    self.chapter_worker(chapters)
+                    for _ in range(self.comic.chapter_threads)])
+            await asyncio.gather(*self.packs)
+        return sorted(self.downloaded)
+
+    async def chapter_worker(self, chapters):
+        """Download chapters one after the other until none are left."""
+        for chapter_num, chapter in chapters:
+            await self.download_chapter(chapter_num, chapter)
+
+    async def call(self, func, *args):
+        """Run a blocking call (extractor, disk) on the executor."""
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def attempt(self, chapter, func, *args):
+        """Await func(*args), retrying after a backoff while allowed."""
+        attempt = 0
+        while True:
+            try:
+                return await func(*args)
+            except Exception as exc:
+                delay = chapter.retry_delay(exc, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def download_chapter(self, chapter_num, chapter):
+        """Discover, download and pack one chapter."""
+        try:
+            pages = await self.attempt(
+                chapter, self.call, chapter.prepare_download)
+            # Like the thread engine, a failing page does not fail the
+            # chapter
+            await asyncio.gather(*[
+                self.download_page(chapter, page) for page in pages])
+            packing = await self.call(chapter.start_packing)
+        except Exception as exc:
+            print('Chapter-%g generated an exception: %s'
+                  % (chapter_num, exc))
+            return
+        # The chapter worker moves on to the next chapter while it packs
+        self.packs.append(asyncio.ensure_future(
+            self.finish_packing(chapter_num, chapter, packing)))
+
+    async def download_page(self, chapter, page):
+        """Download a page, or save a placeholder if it keeps failing."""
+        try:
+            await self.attempt(chapter, self.fetch_page, chapter, page)
+        except Exception:
+            await self.call(chapter.save_placeholder, page[1])
+
+    async def fetch_page(self, chapter, page):
+        """Download a page, unless an earlier run already staged it."""
+        page_num = page[1]
+        url = chapter.image_urls.get(page_num) if chapter.writer else None
+        if url is None:
+            url = await self.call(chapter.resolve_page, page)
+            if url is None:
+                return
+        if chapter.image_cache and \
+                await self.call(chapter.image_cache.get, url):
+            # No request to send: save it from the cache
+            await self.call(chapter.download_image, url, page_num)
+            return
+        async with self.semaphore:
+            data, kind = await self.fetch_image(url, page_num)
+        await self.call(chapter.add_image, url, page_num, kind, data)
+
+    async def fetch_image(self, url, page_num):
+        """Stream an image into memory, return its data and format.
+
+        Raises like the thread engine's requests (see response()), so
+        RetryPolicy classifies the failures of both engines alike.
+        """
+        host = urlparse(url).netloc
+        throttle = host_throttle(host, self.comic.host_connections,
+                                 self.comic.session.rate,
+                                 self.comic.session.burst)
+        while True:
+            wait = throttle.try_acquire()
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+        start = time.monotonic()
+        try:
+            async with self.http.get(url) as r:
+                ttfb = time.monotonic() - start
+                response = self.response(r)
+                throttle.release(response, ttfb)
+                throttle = None
+                METRICS.count('requests', host, status=r.status)
+                METRICS.observe('ttfb', host, ttfb)
+                response.raise_for_status()
+                return await self.stream_image(r, host, page_num)
+        except aiohttp.ClientPayloadError as exc:
+            raise ShortBodyError('Page-%d: %s' % (page_num, exc))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            if throttle:
+                throttle.release()
+            METRICS.count('errors', host, error=type(exc).__name__)
+            raise requests.ConnectionError(exc)
+
+    async def stream_image(self, r, host, page_num):
+        """Read an image body, verifying it like BaseChapter.stream_image.
+
+        aiohttp raises ClientPayloadError itself on a body shorter than
+        its Content-Length.
+        """
+        buf = io.BytesIO()
+        kind = None
+        with METRICS.timer('transfer', host):
+            async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                if not buf.tell():
+                    kind = image_type(chunk)
+                    if kind is None:
+                        raise BadImageError('Page-%d: not an image (%s)' % (
+                            page_num, r.headers.get('Content-Type')))
+                buf.write(chunk)
+        if not buf.tell():
+            raise ShortBodyError('Page-%d: empty body' % (page_num))
+        METRICS.count('bytes', host, buf.tell())
+        return buf.getvalue(), kind
+
+    def response(self, r):
+        """A requests response carrying the status and headers of r.
+
+        raise_for_status() then raises the requests.HTTPError that the
+        retry policy and the host throttle understand.
+        """
+        response = requests.Response()
+        response.status_code = r.status
+        response.reason = r.reason
+        response.url = str(r.url)
+        response.headers = CaseInsensitiveDict(r.headers)
+        return response
+
+    async def finish_packing(self, chapter_num, chapter, packing):
+        """Wait for the pack of a chapter (if any) and report it."""
+        try:
+            if packing:
+                await asyncio.wrap_future(packing)
+            chapter.packed()
+        except Exception as exc:
+            print('Chapter-%g generated an exception: %s'
+                  % (chapter_num, exc))
+        else:
+            self.downloaded.append(chapter_num)
+            print('Downloaded: Chapter-%g' % (chapter_num))
+
+
+def download_comic_async(comic, inflight=None):
+    """Download a comic's chapters with the asyncio engine."""
+    if aiohttp is None:
+        raise ImportError('The async engine needs aiohttp '
+                          '(pip install comic-scraper[async])')
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(AsyncEngine(comic, inflight).run())
+    finally:
+        loop.close()
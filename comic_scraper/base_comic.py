@@ -1,79 +1,533 @@
 """Base Comic class."""
 import os
-from collections import OrderedDict
+import bisect
+import hashlib
+import glob
+import io
+from collections.abc import Mapping
 import concurrent.futures
+import functools
 import shutil
-import requests
-from zipfile import ZipFile, ZIP_DEFLATED
+import socket
+import threading
+import time
+import heapq
+import itertools
+from random import uniform
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 import img2pdf
+import requests
+from urllib.parse import urljoin, urlparse
+from .session import ComicSession
+from .parsers import find_image_list
+from .manifest import Manifest
+from .image_cache import open_cache
+from .http_cache import open_cache as open_html_cache
+from .metrics import METRICS
+from .throttle import retry_after
+from .transform import Transform
+from .packer import packer
+
+# Saved in place of pages that could not be downloaded
+NO_IMAGE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        'extractors', 'no_image_available.png')
+# Read size when streaming images to disk
+CHUNK_SIZE = 2 ** 18
+# File extension of each image format
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
+# HTTP statuses worth retrying
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
 
 
 class BaseComic:
     """Base Comic class. Contains chapters."""
 
     def __init__(self, comic_url, program_args, verify_https):
-        """Init function. Creates chapters for the given comic."""
+        """Init function. Chapters are only scraped when first needed."""
         self.url = comic_url
         self.name = comic_url.split('/')[-1] \
             if comic_url.split('/')[-1] else comic_url.split('/')[-2]
         # Set download location
         self.download_location = os.path.abspath(
             os.path.join(program_args.location, self.name))
-        if not os.path.exists(self.download_location):
-            os.makedirs(self.download_location)
+        os.makedirs(self.download_location, exist_ok=True)
+        # Pages and chapters downloaded by earlier runs (distributed
+        # workers share it, so only the coordinator compacts it)
+        self.manifest = Manifest(
+            os.path.join(self.download_location, '.manifest.jsonl'),
+            compact=not program_args.worker)
         # Set threads and retry values
         self.chapter_threads = program_args.chapterthreads
         self.page_threads = program_args.pagethreads
         self.wait_time = program_args.waittime
         self.max_retries = program_args.retries
+        self.retry_policy = RetryPolicy(self.max_retries, self.wait_time)
+        self.chapter_retries = program_args.chapterretries
         self.file_format = program_args.format
+        self.sync = program_args.sync
+        self.engine = program_args.engine
+        self.inflight = program_args.inflight
+        # Memory shared by all chapters while building PDFs
+        self.pdf_budget = MemoryBudget(program_args.pdfmemory * 2 ** 20)
+        # Images shared with other chapters and comics (None for no cache)
+        self.image_cache = open_cache(
+            program_args.imagecache, program_args.cachesize * 2 ** 20) \
+            if program_args.imagecache else None
+        # Index and page html kept across runs (None for no cache)
+        self.html_cache = open_html_cache(
+            program_args.htmlcache, program_args.htmlcachesize * 2 ** 20) \
+            if program_args.htmlcache else None
+        self.page_ttl = program_args.pagettl
+        # Chapters are packed on worker processes
+        self.packer = packer(program_args.packworkers)
+        # Pages are transformed (e.g. for e-ink readers) if asked
+        self.transform = Transform(
+            program_args.maxwidth, program_args.maxheight,
+            program_args.grayscale, program_args.quality or 85) \
+            if program_args.maxwidth or program_args.maxheight or \
+            program_args.grayscale or program_args.quality else None
+        # Without an html cache (and always in sync mode), the index is
+        # kept in the download location and revalidated on every run
+        self.index_cache = self.html_cache or open_html_cache(
+            os.path.join(self.download_location, '.html'), 2 ** 24)
+        self.index_ttl = program_args.indexttl \
+            if self.html_cache and not self.sync else 0
         # Set verify mode
         self.verify_https = verify_https
-        # Get all chapters and mode of download
-        self.all_chapters = self.extract_chapters()
+        # Shared connection pool (one connection per concurrent page)
+        self.host_connections = program_args.hostconnections or \
+            self.chapter_threads * self.page_threads
+        self.session = ComicSession(
+            host_connections=self.host_connections,
+            host_pools=program_args.hostpools,
+            verify=verify_https,
+            insecure_fallback=True,
+            rate=program_args.ratelimit,
+            burst=program_args.burst)
+        # Chapters are scraped from the index when first needed
+        self.chapter_index = None
+        # (chapter_num, page_num) of the pages saved as placeholders
+        self.failed_pages = []
+
+    @property
+    def all_chapters(self):
+        """Index of all chapters, scraped on first use."""
+        if self.chapter_index is None:
+            chapters = retried(self.scrape_index, self.retry_delay)
+            if not chapters:
+                # Likely an error page: fetch the index again next time
+                self.index_cache.discard(self.url)
+            self.chapter_index = chapters
+        return self.chapter_index
+
+    def scrape_index(self):
+        """Extract the chapters once (the index is cached if it parses)."""
+        with self.index_cache.deferred():
+            return self.extract_chapters()
+
+    def retry_delay(self, exc, attempt):
+        """Backoff before scraping the index again (None to give up)."""
+        kind = self.retry_policy.classify(exc)
+        if kind is None or attempt >= self.retry_policy.max_retries:
+            return None
+        METRICS.count('retries', urlparse(self.url).netloc, kind=kind)
+        return self.retry_policy.delay(attempt, exc)
 
     def set_download_chapters(self, potential_keys=None):
-        """Set chapters to download."""
-        if potential_keys:
-            keys = list(set(potential_keys) & set(self.all_chapters.keys()))
-        else:
-            keys = list(self.all_chapters.keys())
+        """Set chapters to download.
+
+        potential_keys selects them (see ChapterIndex.select); None
+        selects all chapters.
+        """
+        keys = self.all_chapters.select(potential_keys)
+
+        # Skip chapters packed by earlier runs (in sync mode, also the
+        # ones packed and since moved out of the download location)
+        skipped = [key for key in keys
+                   if os.path.exists(self.chapter_file(key)) or
+                   (self.sync and self.manifest.chapter(key))]
+        if skipped:
+            print("Skipping already downloaded chapters:")
+            print(skipped)
+            skipped = set(skipped)
+            keys = [key for key in keys if key not in skipped]
 
-        # Sort keys to make it ascending order and make it a new dict
-        unsorted_chapters = {key: self.all_chapters[key]
-                             for key in keys}
-        self.chapters_to_download = OrderedDict(
-            sorted(unsorted_chapters.items(), key=lambda t: t[0]))
+        # Keys are in ascending order (chapters are created as they are
+        # downloaded)
+        self.chapters_to_download = self.all_chapters.subset(keys)
         # Print downloading chapters
         print("Downloading the below chapters:")
-        print(sorted(keys))
+        print(keys)
 
     def download_comic(self):
-        """Begin download of chapters in the comic."""
-        with concurrent.futures.ThreadPoolExecutor(
-                max_workers=self.chapter_threads) as executor:
-            future_to_chapter = {
-                executor.submit(chapter.download_chapter): chapter_num
-                for chapter_num, chapter in self.chapters_to_download.items()}
+        """Begin download of chapters in the comic.
 
-            for future in concurrent.futures.as_completed(future_to_chapter):
-                chapter_num = future_to_chapter[future]
-                try:
-                    future.result()
-                except Exception as exc:
-                    print('Chapter-%g generated an exception: %s'
-                          % (chapter_num, exc))
-                else:
-                    print('Downloaded: Chapter-%g' % (chapter_num))
+        Returns the numbers of the chapters that were downloaded.
+        """
+        if self.engine == 'async':
+            # aiohttp is only loaded by the async engine
+            from .async_engine import download_comic_async
+            return download_comic_async(self, self.inflight)
+
+        return PageScheduler(self.chapters_to_download,
+                             self.chapter_threads * self.page_threads,
+                             self.chapter_threads).run()
+
+    def chapter_file(self, chapter_num):
+        """Packed file of a chapter."""
+        return os.path.join(self.download_location, '%s-%g.%s' % (
+            self.name, chapter_num, self.file_format))
+
+    def fetch_index(self):
+        """Return the html of the chapter index (self.url).
+
+        An unchanged index (304 to the validators of the last fetch) is
+        served from the html cache.
+        """
+        return self.index_cache.fetch(self.session, self.url, self.index_ttl)
 
     def extract_chapters(self):
         """Extract chapters function (backbone)."""
         pass
 
 
+class PageScheduler:
+    """Schedule the pages of all chapters onto one shared worker pool.
+
+    Page discovery, page downloads and chapter packing are all jobs of
+    the same pool. A chapter is packed as soon as its last page lands,
+    so no chapter holds idle workers while its tail downloads. A failed
+    job waits for its retry in a delay queue, not on a worker, so the
+    workers never sleep on a backoff.
+
+    Chapters saved as files are packed on the packer's processes; a
+    chapter's slot is free as soon as its pack is handed over.
+
+    Memory stays flat whatever the length of the series: at most
+    max_chapters chapters are in progress (the next one is only created
+    when one is done), and at most two jobs per worker are submitted to
+    the pool; the others wait in a queue that favours the later stages,
+    so started pages finish before new ones begin.
+    """
+
+    # Queue priority of each stage (lower first)
+    PRIORITY = {'finish': 0, 'image': 1, 'resolve': 2, 'discover': 3}
+
+    def __init__(self, chapters, workers, max_chapters):
+        """Store chapters (ordered by chapter number) and limits."""
+        self.chapters = chapters
+        self.workers = workers
+        self.max_chapters = max_chapters
+
+    def run(self):
+        """Download and pack all chapters, return the packed ones."""
+        self.pending = {}
+        self.queue = []
+        self.delayed = []
+        self.sequence = itertools.count()
+        self.active = {}
+        self.waiting = iter(self.chapters.items())
+        self.remaining = {}
+        self.packing = {}
+        self.downloaded = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers) as self.executor:
+            self.start_chapters()
+
+            # Bookkeeping only happens here, so no locks are needed
+            while self.pending or self.delayed or self.packing:
+                timeout = max(0, self.delayed[0][0] - time.monotonic()) \
+                    if self.delayed else None
+                if self.pending or self.packing:
+                    done, _ = concurrent.futures.wait(
+                        list(self.pending) + list(self.packing),
+                        timeout=timeout,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+                    done = []
+                for future in done:
+                    if future in self.packing:
+                        self.on_pack(future)
+                        continue
+                    job = self.pending.pop(future)
+                    getattr(self, 'on_' + job[0])(job, future)
+                self.submit_due()
+                self.submit_queued()
+
+        return sorted(self.downloaded)
+
+    def start_chapters(self):
+        """Start chapters until max_chapters are in progress."""
+        while len(self.active) < self.max_chapters:
+            try:
+                chapter_num, chapter = next(self.waiting)
+            except StopIteration:
+                return
+            self.active[chapter_num] = chapter
+            self.submit('discover', chapter_num, chapter.prepare_download)
+
+    def end_chapter(self, chapter_num):
+        """Forget a packed (or failed) chapter and start the next one."""
+        del self.active[chapter_num]
+        self.start_chapters()
+
+    def submit(self, stage, chapter_num, func, *args, attempt=0):
+        """Queue a job of a chapter stage for the pool."""
+        heapq.heappush(self.queue, (self.PRIORITY[stage], next(self.sequence),
+                                    (stage, chapter_num, func, args, attempt)))
+        self.submit_queued()
+
+    def submit_queued(self):
+        """Submit queued jobs while the pool has room for them."""
+        while self.queue and len(self.pending) < 2 * self.workers:
+            job = heapq.heappop(self.queue)[2]
+            future = self.executor.submit(job[2], *job[3])
+            self.pending[future] = job
+
+    def retry_later(self, job, exc):
+        """Schedule a failed job again after its backoff, if allowed.
+
+        The job waits here rather than in a worker, so its worker moves
+        on to other pages in the meantime.
+        """
+        stage, chapter_num, func, args, attempt = job
+        delay = self.active[chapter_num].retry_delay(exc, attempt)
+        if delay is None:
+            return False
+        heapq.heappush(self.delayed, (time.monotonic() + delay,
+                                      next(self.sequence),
+                                      job[:4] + (attempt + 1,)))
+        return True
+
+    def submit_due(self):
+        """Submit the retries whose backoff has elapsed."""
+        while self.delayed and self.delayed[0][0] <= time.monotonic():
+            stage, chapter_num, func, args, attempt = \
+                heapq.heappop(self.delayed)[2]
+            self.submit(stage, chapter_num, func, *args, attempt=attempt)
+
+    def on_discover(self, job, future):
+        """Queue the pages of a discovered chapter."""
+        chapter_num = job[1]
+        try:
+            pages = future.result()
+        except Exception as exc:
+            if not self.retry_later(job, exc):
+                print('Chapter-%g generated an exception: %s'
+                      % (chapter_num, exc))
+                self.end_chapter(chapter_num)
+            return
+
+        chapter = self.active[chapter_num]
+        self.remaining[chapter_num] = len(pages)
+        if not pages:
+            self.submit('finish', chapter_num, chapter.start_packing)
+        # Page html fetches are queued ahead of the image fetches
+        for page in pages:
+            self.submit('resolve', chapter_num, chapter.resolve_page, page)
+
+    def on_resolve(self, job, future):
+        """Queue the image of a page once its url is known."""
+        chapter_num, page = job[1], job[3][0]
+        if future.exception() is None:
+            if future.result() is None:
+                # Staged by an earlier run
+                self.page_done(chapter_num)
+            else:
+                self.submit('image', chapter_num,
+                            self.active[chapter_num].download_image,
+                            future.result(), page[1])
+        elif not self.retry_later(job, future.exception()):
+            self.page_failed(chapter_num, page[1])
+
+    def on_image(self, job, future):
+        """Count a downloaded page."""
+        chapter_num, page_num = job[1], job[3][1]
+        if future.exception() is None:
+            self.page_done(chapter_num)
+        elif not self.retry_later(job, future.exception()):
+            self.page_failed(chapter_num, page_num)
+
+    def page_failed(self, chapter_num, page_num):
+        """Save a placeholder for a page that keeps failing."""
+        # A failing page does not fail the chapter
+        try:
+            self.active[chapter_num].save_placeholder(page_num)
+        except Exception as exc:
+            print('Chapter-%g generated an exception: %s'
+                  % (chapter_num, exc))
+        self.page_done(chapter_num)
+
+    def page_done(self, chapter_num):
+        """Pack the chapter once its last page has landed."""
+        chapter = self.active[chapter_num]
+        self.remaining[chapter_num] -= 1
+        if not self.remaining[chapter_num]:
+            del self.remaining[chapter_num]
+            self.submit('finish', chapter_num, chapter.start_packing)
+
+    def on_finish(self, job, future):
+        """Wait for the pack of a chapter (or report it, if packed)."""
+        chapter_num = job[1]
+        chapter = self.active[chapter_num]
+        if future.exception() is None and future.result() is not None:
+            self.packing[future.result()] = (chapter_num, chapter)
+        else:
+            self.report(chapter_num, chapter, future)
+        self.end_chapter(chapter_num)
+
+    def on_pack(self, future):
+        """Report a chapter packed by the packer."""
+        chapter_num, chapter = self.packing.pop(future)
+        self.report(chapter_num, chapter, future)
+
+    def report(self, chapter_num, chapter, future):
+        """Record and report a packed (or failed) chapter."""
+        try:
+            future.result()
+            chapter.packed()
+        except Exception as exc:
+            print('Chapter-%g generated an exception: %s'
+                  % (chapter_num, exc))
+        else:
+            self.downloaded.append(chapter_num)
+            print('Downloaded: Chapter-%g' % (chapter_num))
+
+
+class ChapterIndex(Mapping):
+    """Chapter urls of a comic, sorted by chapter number.
+
+    Looking a chapter up creates its chapter object (which is not kept),
+    so a long series costs one url per chapter until its chapters are
+    downloaded. Chapter numbers are kept sorted, so ranges of chapters
+    are found by bisection (see select).
+    """
+
+    __slots__ = ('comic', 'chapter_class', 'urls', 'nums')
+
+    def __init__(self, comic, chapter_class, urls=None):
+        """Create an index of chapter_class chapters of comic."""
+        self.comic = comic
+        self.chapter_class = chapter_class
+        self.urls = dict(urls or ())
+        self.nums = sorted(self.urls)
+
+    def add(self, chapter_num, chapter_url):
+        """Add a chapter."""
+        if chapter_num not in self.urls:
+            bisect.insort(self.nums, chapter_num)
+        self.urls[chapter_num] = chapter_url
+
+    def subset(self, chapter_nums):
+        """Index of the given chapters only."""
+        return ChapterIndex(self.comic, self.chapter_class,
+                            [(num, self.urls[num]) for num in chapter_nums])
+
+    def range(self, start=None, stop=None):
+        """Chapter numbers from start to stop (both included, None for
+        no bound)."""
+        low = 0 if start is None else bisect.bisect_left(self.nums, start)
+        high = len(self.nums) if stop is None \
+            else bisect.bisect_right(self.nums, stop)
+        return self.nums[low:high]
+
+    def latest(self, count):
+        """The count highest chapter numbers."""
+        return self.nums[-count:] if count > 0 else []
+
+    def select(self, selection=None):
+        """Sorted chapter numbers of a selection.
+
+        selection is None (all chapters), a ChapterSelection or its text
+        (e.g. '1,5,10:20,last=3'), or chapter numbers.
+        """
+        if selection is None:
+            return list(self.nums)
+        if isinstance(selection, str):
+            selection = ChapterSelection.parse(selection)
+        if isinstance(selection, ChapterSelection):
+            return selection.select(self)
+        return sorted(set(float(num) for num in selection
+                          if float(num) in self.urls))
+
+    def __getitem__(self, chapter_num):
+        """Create the chapter object of a chapter."""
+        return self.chapter_class(self.comic, chapter_num,
+                                  self.urls[chapter_num])
+
+    def __contains__(self, chapter_num):
+        """Check for a chapter (without creating its chapter object)."""
+        return chapter_num in self.urls
+
+    def __iter__(self):
+        """Iterate over chapter numbers, in ascending order."""
+        return iter(self.nums)
+
+    def __len__(self):
+        """Number of chapters."""
+        return len(self.nums)
+
+
+class ChapterSelection:
+    """Chapters to download, as given to -c.
+
+    A comma separated list of chapters (10), ranges (10:20, with both
+    ends included), open-ended ranges (10: or :20) and the latest
+    chapters (last=5), e.g. '1,5,10:20,last=3'.
+    """
+
+    def __init__(self, ranges=(), latest=0):
+        """Select (start, stop) ranges (None for no bound) and the
+        latest chapters."""
+        self.ranges = list(ranges)
+        self.latest = latest
+
+    @classmethod
+    def parse(cls, text):
+        """Parse the -c grammar, raising SyntaxError if it is invalid."""
+        ranges = []
+        latest = 0
+        for part in text.split(','):
+            part = part.strip()
+            try:
+                if part.startswith('last='):
+                    latest = max(latest, int(part[len('last='):]))
+                elif ':' in part:
+                    start, stop = [float(bound) if bound.strip() else None
+                                   for bound in part.split(':')]
+                    if start is not None and stop is not None and \
+                            start > stop:
+                        raise ValueError
+                    ranges.append((start, stop))
+                else:
+                    ranges.append((float(part), float(part)))
+            except ValueError:
+                raise SyntaxError(
+                    "Invalid chapters '%s' (expected e.g. 10, 10:20, 10:, "
+                    ":20, last=5, separated by commas)" % (part))
+        return cls(ranges, latest)
+
+    def select(self, index):
+        """Sorted chapter numbers of the selection in a ChapterIndex."""
+        nums = set(index.latest(self.latest))
+        for start, stop in self.ranges:
+            nums.update(index.range(start, stop))
+        return sorted(nums)
+
+
 class BaseChapter:
     """Base Chapter class. Contains pages."""
 
+    # Chapters of long series are created lazily, but keep them compact
+    __slots__ = (
+        'comic_name', 'comic_download_location', 'chapter_num',
+        'chapter_url', 'host', 'page_threads', 'retry_policy',
+        'retry_budget', 'comic_file_format', 'pdf_budget', 'manifest',
+        'failed_pages', 'image_cache', 'html_cache', 'page_ttl', 'transform',
+        'transforming', 'transformed', 'packer', 'started', 'session',
+        'chapter_location', 'chapter_file', 'writer', 'image_urls')
+
     def __init__(self, comic, chapter_num, chapter_url):
         """Initialize constants required for download."""
         # Extract necessary information from the comic object
@@ -82,79 +536,737 @@ class BaseChapter:
         # Create chapter specific variables
         self.chapter_num = chapter_num
         self.chapter_url = chapter_url
-        # Threads and retry time
+        self.host = urlparse(chapter_url).netloc
+        # Threads and retries
         self.page_threads = comic.page_threads
-        self.wait_time = comic.wait_time
-        self.max_retries = comic.max_retries
+        self.retry_policy = comic.retry_policy
+        self.retry_budget = RetryBudget(comic.chapter_retries)
         self.comic_file_format = comic.file_format
-        # Set verify mode
-        self.verify_https = comic.verify_https
-        # Get download chapter location
+        self.pdf_budget = comic.pdf_budget
+        self.manifest = comic.manifest
+        self.failed_pages = comic.failed_pages
+        self.image_cache = comic.image_cache
+        self.html_cache = comic.html_cache
+        self.page_ttl = comic.page_ttl
+        # Pages handed to the transform and not saved yet
+        self.transform = comic.transform
+        self.transforming = 0
+        self.transformed = threading.Condition()
+        self.packer = comic.packer
+        # Time the chapter's download started (None until it has)
+        self.started = None
+        # Shared session
+        self.session = comic.session
+        # Get download chapter location and packed file name
         self.chapter_location = os.path.join(
             self.comic_download_location, 'chapter-' + str(self.chapter_num))
+        self.chapter_file = comic.chapter_file(chapter_num)
+        # Pages are streamed into the archive in cbz mode
+        self.writer = None
+        # Image urls known without fetching their page (page_num: url)
+        self.image_urls = {}
 
     def download_chapter(self):
         """Download and convert it into a cbz file."""
-        init_status, pages = self.get_pages()
-        download_func = self.download_page
-
-        if not init_status:
-            raise RuntimeError('Unable to obtain pages in the chapter')
-
-        # Create chapter location (if it doesn't exist)
-        if not os.path.exists(self.chapter_location):
-            os.makedirs(self.chapter_location)
+        pages = self.retry(self.prepare_download)
 
         # Download individual pages in parallel
         with concurrent.futures.ThreadPoolExecutor(
                 max_workers=self.page_threads) as executor:
-            executor.map(download_func, pages)
+            executor.map(self.fetch_page_or_placeholder, pages)
+
+        self.finish_download()
+
+    def retry(self, func, *args):
+        """Call func, retrying (blocking this thread) while allowed."""
+        return retried(func, self.retry_delay, *args)
+
+    def retry_delay(self, exc, attempt):
+        """Backoff before retrying a failed attempt (None to give up)."""
+        kind = self.retry_policy.classify(exc)
+        if kind is None or attempt >= self.retry_policy.max_retries or \
+                not self.retry_budget.spend():
+            return None
+        METRICS.count('retries', self.host, kind=kind)
+        return self.retry_policy.delay(attempt, exc)
+
+    def fetch_page_or_placeholder(self, page):
+        """Fetch a page with retries, or save a placeholder instead."""
+        try:
+            self.retry(self.fetch_page, page)
+        except Exception:
+            self.save_placeholder(page[1])
 
-        # Convert the folder to a comic book zip filename
-        chapter_name = os.path.join(
-            self.comic_download_location, '%s-%g'
-            % (self.comic_name, self.chapter_num))
+    def prepare_download(self):
+        """Obtain the pages and create the chapter location."""
+        self.started = time.monotonic()
+        pages = self.parsed(self.get_pages)
 
-        if self.comic_file_format == 'pdf':
-            pdfdir(self.chapter_location, chapter_name + ".pdf")
-        elif self.comic_file_format == 'cbz':
-            zipdir(self.chapter_location, chapter_name + ".cbz")
-        shutil.rmtree(self.chapter_location)
+        if self.comic_file_format == 'cbz':
+            # Download in page order so few pages wait in memory
+            pages = sorted(pages, key=lambda page: page[1])
+            self.writer = CbzWriter(self.chapter_file,
+                                    [page_num for _, page_num in pages])
+        elif not os.path.exists(self.chapter_location):
+            # Create chapter location (if it doesn't exist)
+            os.makedirs(self.chapter_location)
+
+        return pages
+
+    def finish_download(self):
+        """Pack the downloaded pages and remove the chapter location."""
+        packing = self.start_packing()
+        if packing:
+            packing.result()
+        self.packed()
+
+    def start_packing(self):
+        """Pack the chapter, or start packing it on the packer.
+
+        Returns the future of a pack left running on the packer (None if
+        the chapter is packed already), so the calling thread can move
+        on; call packed() once it is done.
+        """
+        self.wait_transforms()
+        if self.started is not None:
+            METRICS.observe('download', self.host,
+                            time.monotonic() - self.started)
+        if self.writer:
+            # Pages were compressed into the cbz as they landed
+            with METRICS.timer('pack', self.host,
+                               format=self.comic_file_format):
+                self.writer.close()
+                self.writer = None
+            return None
+
+        # Pages saved as files (pdf, or cbz of distributed workers); PDFs
+        # hold their images in memory while they are built
+        nbytes = sum(entry.stat().st_size
+                     for entry in os.scandir(self.chapter_location))
+        future = self.packer.submit(
+            pack_folder, self.chapter_location, self.chapter_file,
+            self.comic_file_format, nbytes=nbytes,
+            budget=self.pdf_budget if self.comic_file_format == 'pdf'
+            else None)
+        future.add_done_callback(functools.partial(
+            self.pack_timed, time.monotonic()))
+        return future
+
+    def pack_timed(self, start, future):
+        """Record the time a pack waited for and spent on the packer."""
+        if future.exception() is None:
+            METRICS.observe('pack', self.host, future.result(),
+                            format=self.comic_file_format)
+            METRICS.observe('pack_wait', self.host,
+                            time.monotonic() - start - future.result())
+
+    def packed(self):
+        """Record the packed chapter."""
+        self.manifest.record_chapter(
+            self.chapter_num, os.path.basename(self.chapter_file))
+
+    def wait_transforms(self):
+        """Wait until the pages handed to the transform are saved."""
+        with self.transformed:
+            self.transformed.wait_for(lambda: not self.transforming)
 
     def get_pages(self):
-        """Get pages function (backbone)."""
-        return False, 0
+        """Get pages function (backbone).
 
-    def download_page(self):
-        """Download page (backbone)."""
-        pass
+        Returns a list of (page_url, page_num) in one attempt, raising
+        ParseError (or a requests error) to have it retried.
+        """
+        raise ParseError('Unable to obtain pages in the chapter')
+
+    def find_image(self, html, page_url):
+        """Find image (backbone).
 
-    def download_image(self, url, filename):
-        """Download image (url) and save (filename)."""
-        response = requests.get(url, stream=True, verify=self.verify_https)
-        with open(filename, 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
-        del response
+        Returns the image url in the html of a page, raising ParseError
+        if it is not there.
+        """
+        raise ParseError('No image in %s' % (page_url))
+
+    def resolve_images(self, html, pages):
+        """Note the image urls known from the chapter's first page html.
+
+        If the chapter JS lists an image per page, all images are known
+        and no page html has to be fetched; otherwise the first page's
+        own image is.
+        """
+        with METRICS.timer('parse', self.host):
+            images = find_image_list(html)
+            page_nums = sorted(page_num for _, page_num in pages)
+            if images and len(images) == len(page_nums):
+                self.image_urls.update(zip(
+                    page_nums, [urljoin(self.chapter_url, image)
+                                for image in images]))
+            elif page_nums:
+                try:
+                    self.image_urls[page_nums[0]] = self.find_image(
+                        html, self.chapter_url)
+                except ParseError:
+                    pass
+
+    def get_image_url(self, page):
+        """Image url of a page (fetching its html if not known yet)."""
+        page_url, page_num = page
+        if page_num in self.image_urls:
+            return self.image_urls[page_num]
+        return self.parsed(self.scrape_image, page_url)
+
+    def scrape_image(self, page_url):
+        """Fetch the html of a page and find its image url."""
+        html = self.fetch_html(page_url)
+        with METRICS.timer('parse', self.host):
+            return self.find_image(html, page_url)
+
+    def parsed(self, func, *args):
+        """Call func, caching the page html it fetches only if it returns.
+
+        A page that does not parse (e.g. a maintenance page served with a
+        200) is then fetched again by the next attempt.
+        """
+        if not self.html_cache:
+            return func(*args)
+        with self.html_cache.deferred():
+            return func(*args)
+
+    def download_page(self, page):
+        """Download a page: resolve its image url, then the image."""
+        self.download_image(self.get_image_url(page), page[1])
+
+    def fetch_html(self, url):
+        """Return the html of a page, raising on an error status."""
+        if self.html_cache:
+            return self.html_cache.fetch(self.session, url, self.page_ttl)
+        r = self.session.get(url)
+        r.raise_for_status()
+        return r.text
+
+    def fetch_page(self, page):
+        """Download a page, unless an earlier run already staged it."""
+        image = self.resolve_page(page)
+        if image:
+            self.download_image(image, page[1])
+
+    def resolve_page(self, page):
+        """Image url of a page (None if an earlier run staged it)."""
+        if not self.writer and self.is_staged(page[1]):
+            return None
+        return self.get_image_url(page)
+
+    def is_staged(self, page_num):
+        """Check a staged page against its manifest record."""
+        record = self.manifest.page(self.chapter_num, page_num)
+        if not record:
+            return False
+        filename = os.path.join(self.chapter_location, record.get(
+            'file', self.page_filename(page_num)))
+        if not os.path.exists(filename) or \
+                os.path.getsize(filename) != record['size']:
+            return False
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest() == record['sha1']
+
+    def page_filename(self, page_num, kind='jpeg'):
+        """File name of a page of the given image format."""
+        return '%0.3d.%s' % (page_num, EXTENSIONS.get(kind, kind))
+
+    def page_partname(self, page_num):
+        """Path a page is written to before it is verified and saved."""
+        return os.path.join(self.chapter_location, '%0.3d.part' % (page_num))
+
+    def store_page(self, page_num, url, kind, data):
+        """Save image data as the given page and record it.
+
+        Returns the page's file name.
+        """
+        partname = self.page_partname(page_num)
+        with open(partname, 'wb') as out_file:
+            out_file.write(data)
+        filename = self.save_page(page_num, kind, partname)
+        self.manifest.record_page(self.chapter_num, page_num, url, len(data),
+                                  hashlib.sha1(data).hexdigest(), filename)
+        return filename
+
+    def save_page(self, page_num, kind, partname):
+        """Move a verified image into place as the given page.
+
+        Returns the page's file name. A copy of the page in another
+        format (saved by an earlier attempt) is removed.
+        """
+        filename = self.page_filename(page_num, kind)
+        for other in glob.glob(os.path.join(
+                self.chapter_location, '%0.3d.*' % (page_num))):
+            if os.path.basename(other) != filename and \
+                    not other.endswith('.part'):
+                os.remove(other)
+        os.replace(partname, os.path.join(self.chapter_location, filename))
+        return filename
+
+    def download_image(self, url, page_num):
+        """Download image (url) and save it as the given page."""
+        if self.writer:
+            data, kind = self.fetch_image(url, page_num)
+            self.add_page(page_num, url, kind, data)
+            return
+        cached = self.image_cache.get(url) if self.image_cache else None
+        if cached:
+            self.save_cached_image(cached, url, page_num)
+            return
+
+        with self.session.get(url, stream=True) as response:
+            response.raise_for_status()
+            # Only verified images replace the page
+            partname = self.page_partname(page_num)
+            try:
+                with open(partname, 'wb') as out_file:
+                    size, sha1, kind = self.stream_image(
+                        response, page_num, out_file)
+                filename = self.save_page(page_num, kind, partname)
+            finally:
+                if os.path.exists(partname):
+                    os.remove(partname)
+        self.manifest.record_page(self.chapter_num, page_num, url, size,
+                                  sha1, filename)
+        METRICS.count('pages', self.host)
+        if self.image_cache:
+            self.image_cache.put_file(
+                url, os.path.join(self.chapter_location, filename), sha1)
+        if self.transform:
+            with open(os.path.join(self.chapter_location, filename),
+                      'rb') as image:
+                self.transform_page(page_num, url, kind, image.read())
+
+    def fetch_image(self, url, page_num):
+        """Download image (url) into memory, return its data and format."""
+        cached = self.image_cache.get(url) if self.image_cache else None
+        if cached:
+            METRICS.count('pages', self.host, cached=True)
+            with open(cached, 'rb') as image:
+                data = image.read()
+            return data, image_type(data[:16]) or 'jpeg'
+
+        with self.session.get(url, stream=True) as response:
+            response.raise_for_status()
+            buf = io.BytesIO()
+            _, _, kind = self.stream_image(response, page_num, buf)
+        data = buf.getvalue()
+        METRICS.count('pages', self.host)
+        if self.image_cache:
+            self.image_cache.put(url, data)
+        return data, kind
+
+    def add_image(self, url, page_num, kind, data):
+        """Save an image downloaded into memory as the given page."""
+        METRICS.count('pages', self.host)
+        if self.image_cache:
+            self.image_cache.put(url, data)
+        if self.writer:
+            self.add_page(page_num, url, kind, data)
+            return
+        self.store_page(page_num, url, kind, data)
+        if self.transform:
+            self.transform_page(page_num, url, kind, data)
+
+    def add_page(self, page_num, url, kind, data):
+        """Add a page to the cbz (once transformed, if asked)."""
+        if self.transform:
+            self.transform_page(page_num, url, kind, data)
+        else:
+            self.writer.add(page_num, self.page_filename(page_num, kind),
+                            data)
+
+    def transform_page(self, page_num, url, kind, data):
+        """Hand a saved page to the transform.
+
+        The transform runs on the process pool while the chapter's other
+        pages download; the page is replaced (or added to the cbz) once
+        transformed, and start_packing waits for all of them.
+        """
+        with self.transformed:
+            self.transforming += 1
+        future = self.transform.submit(data, kind)
+        future.add_done_callback(functools.partial(
+            self.page_transformed, page_num, url, kind, data,
+            time.monotonic()))
+
+    def page_transformed(self, page_num, url, kind, data, start, future):
+        """Save a transformed page (or keep the original if it failed)."""
+        try:
+            METRICS.observe('transform', self.host, time.monotonic() - start)
+            try:
+                data, kind = future.result()
+            except Exception as exc:
+                print('Transform failed: Chapter-%g, page-%d (%s)'
+                      % (self.chapter_num, page_num, exc))
+                if not self.writer:
+                    return
+            if self.writer:
+                self.writer.add(page_num, self.page_filename(page_num, kind),
+                                data)
+                return
+            self.store_page(page_num, url, kind, data)
+        finally:
+            with self.transformed:
+                self.transforming -= 1
+                self.transformed.notify_all()
+
+    def stream_image(self, response, page_num, out_file):
+        """Copy an image body to out_file, verifying it on the way.
+
+        Returns the size, sha1 and format of the image. Raises
+        BadImageError if the body does not start like an image (e.g. an
+        html error page) and ShortBodyError if it ends before its
+        Content-Length.
+        """
+        host = urlparse(response.url).netloc
+        sha1 = hashlib.sha1()
+        size = 0
+        kind = None
+        with METRICS.timer('transfer', host):
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if not size:
+                    kind = image_type(chunk)
+                    if kind is None:
+                        raise BadImageError('Page-%d: not an image (%s)' % (
+                            page_num, response.headers.get('Content-Type')))
+                out_file.write(chunk)
+                sha1.update(chunk)
+                size += len(chunk)
+        if not size:
+            raise ShortBodyError('Page-%d: empty body' % (page_num))
+        METRICS.count('bytes', host, size)
+
+        # Content-Length counts the bytes on the wire (before decoding)
+        expected = response.headers.get('Content-Length')
+        received = response.raw.tell()
+        if expected and received < int(expected):
+            raise ShortBodyError('Page-%d: got %d of %s bytes'
+                                 % (page_num, received, expected))
+        return size, sha1.hexdigest(), kind
+
+    def save_cached_image(self, cached, url, page_num):
+        """Save an image from the cache (blob path) as the given page."""
+        METRICS.count('pages', self.host, cached=True)
+        with open(cached, 'rb') as image:
+            kind = image_type(image.read(16)) or 'jpeg'
+        partname = self.page_partname(page_num)
+        shutil.copyfile(cached, partname)
+        filename = self.save_page(page_num, kind, partname)
+        # Blobs are named after their sha1
+        self.manifest.record_page(self.chapter_num, page_num, url,
+                                  os.path.getsize(cached),
+                                  os.path.basename(cached), filename)
+        if self.transform:
+            with open(cached, 'rb') as image:
+                self.transform_page(page_num, url, kind, image.read())
+
+    def save_placeholder(self, page_num):
+        """Save the 'no image available' image as the given page."""
+        print("Failed download: Chapter-%g, page-%d"
+              % (self.chapter_num, page_num))
+        METRICS.count('placeholders', self.host)
+        self.failed_pages.append((self.chapter_num, page_num))
+        if self.writer:
+            with open(NO_IMAGE, 'rb') as image:
+                self.writer.add(page_num, self.page_filename(page_num, 'png'),
+                                image.read())
+        else:
+            partname = self.page_partname(page_num)
+            shutil.copyfile(NO_IMAGE, partname)
+            self.save_page(page_num, 'png', partname)
+
+
+class ParseError(Exception):
+    """A page did not contain what the extractor looked for."""
+
+
+class ShortBodyError(Exception):
+    """A response body ended before its announced length."""
+
+
+class BadImageError(Exception):
+    """A response body is not an image."""
+
+
+class RetryPolicy:
+    """Which failures are retried, and the backoff between attempts."""
+
+    def __init__(self, max_retries, max_wait, base_wait=0.5):
+        """Retry max_retries times, backing off up to max_wait seconds."""
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.base_wait = base_wait
+
+    def classify(self, exc):
+        """Return the kind of a retryable failure (None if fatal)."""
+        if isinstance(exc, ParseError):
+            return 'parse'
+        elif isinstance(exc, ShortBodyError):
+            return 'short body'
+        elif isinstance(exc, BadImageError):
+            return 'bad image'
+        elif isinstance(exc, requests.HTTPError):
+            if exc.response is not None and \
+                    exc.response.status_code in RETRY_STATUSES:
+                return 'http status'
+        elif isinstance(exc, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError)):
+            return 'network'
+        return None
+
+    def delay(self, attempt, exc=None):
+        """Exponential backoff (with jitter) before the next attempt.
+
+        A Retry-After of the failed response (exc) is waited at least.
+        """
+        wait = min(self.max_wait, self.base_wait * 2 ** attempt)
+        # Idea from manga_downloader (which in turn was from wget)
+        wait = uniform(0.5 * wait, 1.5 * wait)
+        response = getattr(exc, 'response', None)
+        if response is not None:
+            wait = max(wait, retry_after(response) or 0)
+        return wait
+
+
+class RetryBudget:
+    """Retries a chapter may spend across all of its pages."""
+
+    def __init__(self, retries):
+        """Set the number of retries."""
+        self.retries = retries
+        self.lock = threading.Lock()
+
+    def spend(self):
+        """Take one retry from the budget, if any is left."""
+        with self.lock:
+            if self.retries <= 0:
+                return False
+            self.retries -= 1
+            return True
+
+
+def retried(func, retry_delay, *args):
+    """Call func(*args), retrying (blocking this thread) while allowed.
+
+    retry_delay(exc, attempt) returns the seconds to wait before the next
+    attempt, or None to give up and raise exc.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args)
+        except Exception as exc:
+            delay = retry_delay(exc, attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+
+class CbzWriter:
+    """Write downloaded pages straight into a cbz archive.
+
+    Pages are added from any thread, in any order, and are written to the
+    archive in page order (pages arriving early wait in memory). The
+    archive is built as <filename>.part and only renamed to filename once
+    closed, so a crash never leaves a truncated cbz behind.
+    """
+
+    def __init__(self, filename, page_nums):
+        """Open the partial archive for the given (sorted) page numbers."""
+        self.filename = filename
+        self.partname = filename + '.part'
+        self.order = list(page_nums)
+        self.next_page = 0
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.zipf = ZipFile(self.partname, 'w', ZIP_DEFLATED)
+
+    def add(self, page_num, arcname, data):
+        """Add a page; write it and any pages waiting on it in order."""
+        with self.lock:
+            self.waiting[page_num] = (arcname, data)
+            while (self.next_page < len(self.order) and
+                   self.order[self.next_page] in self.waiting):
+                self.write(*self.waiting.pop(self.order[self.next_page]))
+                self.next_page += 1
+
+    def write(self, arcname, data):
+        """Write one page (stored, if already compressed)."""
+        self.zipf.writestr(arcname, data, compress_type=compression(data))
+
+    def close(self):
+        """Write remaining pages and move the archive into place."""
+        with self.lock:
+            for page_num in sorted(self.waiting):
+                self.write(*self.waiting[page_num])
+            self.waiting = {}
+            self.zipf.close()
+            with open(self.partname, 'rb') as part:
+                os.fsync(part.fileno())
+            os.replace(self.partname, self.filename)
+
+
+def image_type(data):
+    """Image format of data from its magic bytes (None if unknown).
+
+    Only formats Pillow decodes are known, so any page can be converted
+    for a PDF (whatever its Content-Type, e.g. image/svg+xml is not).
+    """
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    elif data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    elif data.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    elif data.startswith(b'BM'):
+        return 'bmp'
+    elif data.startswith((b'II*\x00', b'MM\x00*')):
+        return 'tiff'
+    return None
+
+
+def is_compressed_image(data):
+    """Check the magic bytes of already compressed image formats."""
+    return image_type(data) in ('jpeg', 'png', 'gif', 'webp')
+
+
+def compression(data):
+    """Zip compression of a page from its first bytes.
+
+    Already compressed images are stored: deflating them again costs CPU
+    for next to no gain.
+    """
+    return ZIP_STORED if is_compressed_image(data) else ZIP_DEFLATED
 
 
 def zipdir(folder, filename):
-    """Zip folder."""
+    """Zip folder (pages stored or deflated as by CbzWriter)."""
     assert os.path.isdir(folder)
     zipf = ZipFile(filename, 'w', ZIP_DEFLATED)
     for root, dirs, files in os.walk(folder):
         # note: ignore empty directories
-        for fn in sorted(files):
-            zipf.write(
-                os.path.join(root, fn),
-                os.path.relpath(os.path.join(root, fn), folder))
+        for fn in sorted(fn for fn in files if not fn.endswith('.part')):
+            path = os.path.join(root, fn)
+            with open(path, 'rb') as f:
+                head = f.read(16)
+            zipf.write(path, os.path.relpath(path, folder),
+                       compress_type=compression(head))
     zipf.close()
 
 
 def pdfdir(folder, filename):
-    """Create PDF of images in the folder."""
+    """Create PDF of images in the folder.
+
+    The PDF is written out as it is generated instead of being built as
+    one bytes object first.
+    """
     assert os.path.isdir(folder)
-    with open(filename, "wb") as f:
-        for root, dirs, files in os.walk(folder):
-            # Convert images to pdf
-            f.write(img2pdf.convert(
-                [os.path.join(root, fn) for fn in sorted(files)]))
+    images = [os.path.join(folder, fn) for fn in sorted(os.listdir(folder))
+              if not fn.endswith('.part')]
+    # Formats img2pdf cannot embed as they are become PNGs (one after the
+    # other: chapters are packed on a process each)
+    convert = [image for image in images if not pdf_ready(image)]
+    if convert:
+        converted = dict(zip(convert, map(to_png, convert)))
+        images = [converted.get(image, image) for image in images]
+    partname = pack_partname(filename)
+    with open(partname, "wb") as f:
+        img2pdf.convert(images, outputstream=f)
+    os.replace(partname, filename)
+
+
+def pack_folder(folder, filename, file_format):
+    """Pack the pages saved in folder as filename, then remove folder.
+
+    Runs on the packer; returns the seconds it took.
+    """
+    start = time.monotonic()
+    if file_format == 'pdf':
+        pdfdir(folder, filename)
+    else:
+        partname = pack_partname(filename)
+        zipdir(folder, partname)
+        os.replace(partname, filename)
+    # A distributed worker whose lease ran out may pack it twice
+    shutil.rmtree(folder, ignore_errors=True)
+    return time.monotonic() - start
+
+
+def pack_partname(filename):
+    """Partial file a pack of filename is written to.
+
+    The name is unique to the packing process (on any machine sharing the
+    download location), so two packs of the same chapter never write to
+    the same file.
+    """
+    return '%s.%s.%d.part' % (filename, socket.gethostname(), os.getpid())
+
+
+def pdf_ready(filename):
+    """Check that img2pdf embeds an image file without decoding it.
+
+    That is JPEG, and PNG without an alpha channel (which img2pdf
+    refuses).
+    """
+    with open(filename, 'rb') as f:
+        head = f.read(32)
+    kind = image_type(head)
+    if kind == 'png':
+        # Color type in the IHDR chunk: 4 and 6 carry alpha
+        return head[25:26] not in (b'\x04', b'\x06')
+    return kind == 'jpeg'
+
+
+def to_png(filename):
+    """Convert an image file to an RGB PNG beside it, return its name.
+
+    Runs on the packer. Transparency is flattened on white and
+    only the first frame of an animation is kept.
+    """
+    from PIL import Image
+    pngname = os.path.splitext(filename)[0] + '.png'
+    with Image.open(filename) as image:
+        image = image.convert('RGBA')
+        page = Image.new('RGB', image.size, (255, 255, 255))
+        page.paste(image, mask=image.split()[3])
+        page.save(pngname + '.part', 'PNG')
+    if pngname != filename:
+        os.remove(filename)
+    os.replace(pngname + '.part', pngname)
+    return pngname
+
+
+class MemoryBudget:
+    """Bytes that concurrent packing jobs may hold in memory at once."""
+
+    def __init__(self, limit):
+        """Set the limit (in bytes)."""
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        """Block until nbytes fit in the budget, then reserve them.
+
+        A single job larger than the whole budget runs alone.
+        """
+        nbytes = min(nbytes, self.limit)
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.used + nbytes <= self.limit)
+            self.used += nbytes
+
+    def release(self, nbytes):
+        """Return nbytes to the budget."""
+        nbytes = min(nbytes, self.limit)
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 import argparse
-import requests
+import concurrent.futures
+import importlib.util
 import os
+import sys
+import threading
+import time
 from urllib.parse import urlparse
-from urllib3.exceptions import InsecureRequestWarning
-import current_comic
+from . import current_comic
+from .base_comic import ChapterSelection
+from . import image_cache
+from . import http_cache
+from . import metrics
+from . import job_queue
+from . import distributed
 
 
-def main():
-    """Parse input and download comic(s)."""
+def argument_parser():
+    """Command line parser (its defaults are also those of Config)."""
     parser = argparse.ArgumentParser(
         description=(
             'Downloads all manga chapters from'
@@ -18,71 +27,317 @@ def main():
             'for the kingdom manga chapters in the url, downloads them all, '
             'and makes cbz files of all chapters.'))
 
-    parser.add_argument('urls', metavar='url', nargs='+',
+    parser.add_argument('urls', metavar='url', nargs='*',
                         help='Comic urls to download')
+    parser.add_argument(
+        "-b", "--batch", default=None,
+        help="Read comic urls (one per line) from a file ('-' for stdin).")
+    parser.add_argument(
+        "-cc", "--comicthreads", default=1, type=int,
+        help="Number of comics downloaded in parallel.")
+    parser.add_argument(
+        "-hm", "--hostcomics", default=2, type=int,
+        help="Number of comics of the same host downloaded in parallel.")
     parser.add_argument(
         "-l", "--location", default=os.getcwd(), help="set download location")
     parser.add_argument(
         "-c", "--chapters", default=False,
-        help="Specify chapters to download separated by : (10:20).")
+        help=("Chapters to download: a chapter (10), a range (10:20), an "
+              "open range (10: or :20) or the latest chapters (last=5), "
+              "several of them separated by commas (1,5,10:20)."))
     parser.add_argument(
-        "-ct", "--chapterthreads", default=5,
+        "-ct", "--chapterthreads", default=5, type=int,
         help="Number of parallel chapters downloads.")
     parser.add_argument(
-        "-pt", "--pagethreads", default=10,
+        "-pt", "--pagethreads", default=10, type=int,
         help="Number of parallel chapter pages downloads (per chapter).")
     parser.add_argument(
-        "-wt", "--waittime", default=15,
-        help="Wait time before retry if encountered with an error")
+        "-wt", "--waittime", default=15, type=float,
+        help=("Maximum wait time before a retry (retries back off "
+              "exponentially up to it)."))
+    parser.add_argument(
+        "-rt", "--retries", default=10, type=int,
+        help="Number of retries of a page before giving up")
     parser.add_argument(
-        "-rt", "--retries", default=10,
-        help="Number of retries before giving up")
+        "-cr", "--chapterretries", default=50, type=int,
+        help="Number of retries all pages of a chapter may use together.")
     parser.add_argument(
         "-f", "--format", default='pdf',
         help="File format of the downloaded file, supported 'pdf' and 'cbz'")
+    parser.add_argument(
+        "-s", "--sync", action='store_true',
+        help=("Only download chapters not downloaded by earlier runs "
+              "(even if since moved), revalidating the chapter index."))
+    parser.add_argument(
+        "-ic", "--imagecache", nargs='?', const=image_cache.CACHE_DIR,
+        default=None,
+        help=("Reuse images from (and save them to) a local cache, "
+              "by default %s." % (image_cache.CACHE_DIR)))
+    parser.add_argument(
+        "-cs", "--cachesize", default=1024, type=int,
+        help="Maximum size (MB) of the image cache.")
+    parser.add_argument(
+        "-hh", "--htmlcache", nargs='?', const=http_cache.CACHE_DIR,
+        default=None,
+        help=("Reuse chapter indexes and page html from (and save them to) "
+              "a local cache, by default %s." % (http_cache.CACHE_DIR)))
+    parser.add_argument(
+        "-hs", "--htmlcachesize", default=64, type=int,
+        help="Maximum size (MB) of the html cache.")
+    parser.add_argument(
+        "-it", "--indexttl", default=3600, type=int,
+        help=("Seconds a cached chapter index is reused before being "
+              "revalidated (unless the site says otherwise)."))
+    parser.add_argument(
+        "-gt", "--pagettl", default=7 * 24 * 3600, type=int,
+        help=("Seconds a cached chapter or page html is reused before "
+              "being revalidated (unless the site says otherwise)."))
+    parser.add_argument(
+        "-mw", "--maxwidth", default=None, type=int,
+        help="Downscale pages wider than this (pixels).")
+    parser.add_argument(
+        "-mh", "--maxheight", default=None, type=int,
+        help="Downscale pages taller than this (pixels).")
+    parser.add_argument(
+        "-gs", "--grayscale", action='store_true',
+        help="Convert pages to grayscale.")
+    parser.add_argument(
+        "-q", "--quality", default=None, type=int,
+        help=("JPEG quality of transformed pages (default 85 when "
+              "downscaling or converting to grayscale)."))
+    parser.add_argument(
+        "-pw", "--packworkers", default=None, type=int,
+        help="Number of processes packing chapters (default: one per core).")
+    parser.add_argument(
+        "-pm", "--pdfmemory", default=512, type=int,
+        help=("Memory ceiling (MB) for images held by concurrent PDF "
+              "conversions."))
+    parser.add_argument(
+        "-hc", "--hostconnections", default=None, type=int,
+        help=("Maximum open connections per host "
+              "(default: chapterthreads * pagethreads)."))
+    parser.add_argument(
+        "-hp", "--hostpools", default=10, type=int,
+        help="Number of per-host connection pools kept alive.")
+    parser.add_argument(
+        "-rl", "--ratelimit", default=None, type=float,
+        help="Maximum requests per second to a host (default: no limit).")
+    parser.add_argument(
+        "-bu", "--burst", default=None, type=int,
+        help="Requests a host may receive at once under the rate limit.")
+    parser.add_argument(
+        "-e", "--engine", default='thread', choices=['thread', 'async'],
+        help=("Download engine: a pool of threads, or an asyncio event "
+              "loop streaming images with aiohttp."))
+    parser.add_argument(
+        "-if", "--inflight", default=None, type=int,
+        help=("Maximum images in flight with the async engine "
+              "(default: chapterthreads * pagethreads)."))
+    parser.add_argument(
+        "-st", "--stats", action='store_true',
+        help=("Print per-host throughput and latency percentiles "
+              "at the end of the run."))
+    parser.add_argument(
+        "-mf", "--metricsfile", default=None,
+        help="Append every request/page/chapter metric to a JSON-lines file.")
+    parser.add_argument(
+        "-mp", "--metricsport", default=None, type=int,
+        help=("Serve metrics for Prometheus on this port of localhost "
+              "(at /metrics)."))
+    parser.add_argument(
+        "-qu", "--queue", default=None,
+        help=("Job queue shared by distributed workers (an SQLite file or "
+              "a url of another backend). The chapters of the given urls "
+              "are queued instead of downloaded."))
+    parser.add_argument(
+        "-wk", "--worker", action='store_true',
+        help=("Download the chapters of --queue (with -ct * -pt threads) "
+              "until none are left. Workers must share the location."))
+    return parser
+
 
+def main():
+    """Parse input and download comic(s)."""
+    parser = argument_parser()
     args = parser.parse_args()
 
-    for url in args.urls:
-        # If https, check before using verify False
-        urlscheme = urlparse(url)
-        verify_https = False
-        if urlscheme.scheme == 'https':
+    urls = list(args.urls)
+    if args.batch:
+        urls += read_batch(args.batch)
+    if args.worker and not args.queue:
+        parser.error('--worker needs a --queue')
+    if args.engine == 'async' and not importlib.util.find_spec('aiohttp'):
+        parser.error('--engine async needs aiohttp '
+                     '(pip install comic-scraper[async])')
+    if not urls and not args.worker:
+        parser.error('no comic urls given')
+
+    if args.metricsfile:
+        metrics.METRICS.add_sink(metrics.JsonLinesSink(args.metricsfile))
+    if args.metricsport:
+        metrics.METRICS.add_sink(
+            metrics.PrometheusSink(metrics.METRICS, args.metricsport))
+
+    raise_open_files_limit(args)
+    potential_keys = parse_chapters(args.chapters)
+    try:
+        if args.worker:
+            distributed.Worker(job_queue.open_queue(args.queue), args).run()
+        elif args.queue:
+            publish_batch(urls, args, potential_keys)
+        else:
+            download_batch(urls, args, potential_keys)
+    finally:
+        if args.stats:
+            print(metrics.METRICS.summary())
+        metrics.METRICS.close()
+
+
+def parse_chapters(chapters):
+    """Parse the chapters input into a ChapterSelection (None for all)."""
+    if not chapters:
+        return None
+    return ChapterSelection.parse(chapters)
+
+
+def raise_open_files_limit(args):
+    """Make room for the sockets and files a run may hold open at once.
+
+    Sockets are capped per host by the connection pools (pages and images
+    may come from two hosts), and open files by the workers (one page
+    each) and the chapters being packed.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not available (nor needed) on Windows
+        return
+    workers = args.chapterthreads * args.pagethreads
+    connections = args.hostconnections or workers
+    needed = args.comicthreads * (
+        2 * connections + workers + args.chapterthreads) + 64
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    if limit < needed:
+        print('Open files are limited to %d (%d may be needed); '
+              'lower -ct/-pt/-hc/-cc if downloads fail.' % (limit, needed))
+
+
+def read_batch(batch):
+    """Read comic urls, one per line, from a file ('-' for stdin)."""
+    f = sys.stdin if batch == '-' else open(batch)
+    try:
+        # Skip blank lines and comments
+        return [line.strip() for line in f
+                if line.strip() and not line.strip().startswith('#')]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def download_url(url, args, potential_keys):
+    """Download a comic, return its name and downloaded chapters."""
+    if current_comic.extractor(url) is None:
+        raise ValueError('Unsupported comic url: %s' % (url))
+    # https certificates are verified, unless they turn out invalid (see
+    # session.ComicSession)
+    verify_https = urlparse(url).scheme == 'https'
+    comic = current_comic.comic(url, args, verify_https)
+    print('Downloading comic: ' + comic.name)
+
+    # Get chapters to download
+    comic.set_download_chapters(potential_keys)
+    downloaded = comic.download_comic()
+    print('Downloaded comic:' + url.split('/')[-1])
+    return (comic.name, len(comic.chapters_to_download), downloaded,
+            len(comic.failed_pages))
+
+
+def download_batch(urls, args, potential_keys):
+    """Download comics in parallel (bounded per host) and summarize."""
+    # At most args.hostcomics comics of the same host at once
+    host_slots = {urlparse(url).netloc:
+                  threading.BoundedSemaphore(args.hostcomics)
+                  for url in urls}
+
+    def download_limited(url):
+        with host_slots[urlparse(url).netloc]:
+            start = time.time()
+            return download_url(url, args, potential_keys) + \
+                (time.time() - start,)
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.comicthreads) as executor:
+        future_to_url = {executor.submit(download_limited, url): url
+                         for url in urls}
+        for future in concurrent.futures.as_completed(future_to_url):
+            url = future_to_url[future]
             try:
-                requests.get(url)
-                verify_https = True
-            except requests.exceptions.SSLError:
-                verify_https = False
-                print('Could not validate https certificate for url:' +
-                      '%s. Proceeding with Insecure certificate.' % (url))
-                requests.packages.urllib3.disable_warnings(
-                    category=InsecureRequestWarning)
-
-        comic = current_comic.comic(url, args, verify_https)
-        print('Downloading comic: ' + comic.name)
-
-        # Get chapters to download
-        if args.chapters:
+                results[url] = future.result()
+            except Exception as exc:
+                print('Comic %s generated an exception: %s' % (url, exc))
+                results[url] = exc
+
+    print_summary(urls, results)
+    return results
+
+
+def publish_batch(urls, args, potential_keys):
+    """Queue the chapters of comics for distributed workers."""
+    queue = job_queue.open_queue(args.queue)
+
+    def publish(url):
+        if current_comic.extractor(url) is None:
+            raise ValueError('Unsupported comic url: %s' % (url))
+        comic = current_comic.comic(url, args,
+                                    urlparse(url).scheme == 'https')
+        comic.set_download_chapters(potential_keys)
+        return distributed.publish(comic, queue)
+
+    queued = 0
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.comicthreads) as executor:
+        future_to_url = {executor.submit(publish, url): url for url in urls}
+        for future in concurrent.futures.as_completed(future_to_url):
+            url = future_to_url[future]
             try:
-                start_stop = args.chapters.split(':')
-                if len(start_stop) == 1:
-                    potential_keys = [float(start_stop[0])]
-                elif len(start_stop) == 2:
-                    potential_keys = [
-                        i * 0.5 for i in range(2 * int(start_stop[0]),
-                                               2 * int(start_stop[1]) + 1)]
-                else:
-                    raise SyntaxError(
-                        "Chapter inputs should be separated by ':'")
-            except TypeError:
-                raise SyntaxError("Chapter inputs should be separated by ':'")
-
-            comic.set_download_chapters(potential_keys)
-        else:
-            comic.set_download_chapters()
+                queued += future.result()
+                print('Queued comic: %s (%d chapters)'
+                      % (url, future.result()))
+            except Exception as exc:
+                print('Comic %s generated an exception: %s' % (url, exc))
+    print('%d chapters queued in %s' % (queued, args.queue))
+
 
-        comic.download_comic()
-        print('Downloaded comic:' + url.split('/')[-1])
+def print_summary(urls, results):
+    """Print one line per comic url and the totals."""
+    print('Summary:')
+    failed = 0
+    for url in urls:
+        result = results[url]
+        if isinstance(result, Exception):
+            failed += 1
+            print('  FAILED  %s (%s)' % (url, result))
+        else:
+            name, requested, downloaded, placeholders, elapsed = result
+            status = 'OK' if len(downloaded) == requested and \
+                not placeholders else 'PARTIAL'
+            print('  %-7s %s: %d/%d chapters in %.1fs%s'
+                  % (status, name, len(downloaded), requested, elapsed,
+                     ' (%d pages missing)' % (placeholders)
+                     if placeholders else ''))
+    print('%d comics, %d failed' % (len(urls), failed))
+    # Time of each stage, summed over chapters
+    downloading = metrics.METRICS.total('download')
+    if downloading:
+        print('Chapters: %.1fs downloading, %.1fs packing '
+              '(%.1fs waiting for the packer)'
+              % (downloading, metrics.METRICS.total('pack'),
+                 metrics.METRICS.total('pack_wait')))
 
 
 if __name__ == '__main__':
@@ -1,18 +1,70 @@
 """Define current comic class based on url."""
+import importlib
+import re
 
-from extractors.mangafox import MangaFoxComic
-from extractors.mangahere import MangaHereComic
-from extractors.mangastream import MangaStreamComic
-from extractors.mangareader import MangaReaderComic
+# (url pattern, "module:Class") of the built-in extractors (modules
+# relative to this package); a module is only imported when a url needs it
+EXTRACTORS = [
+    (r'mangafox', '.extractors.mangafox:MangaFoxComic'),
+    (r'mangahere', '.extractors.mangahere:MangaHereComic'),
+    (r'mangas?tream|readms', '.extractors.mangastream:MangaStreamComic'),
+    (r'mangareader', '.extractors.mangareader:MangaReaderComic'),
+]
+# Entry point group of extractors from other packages (name: url pattern,
+# value: "module:Class")
+ENTRY_POINT_GROUP = 'comic_scraper.extractors'
+
+_plugins = None
+_classes = {}
+
+
+def register(pattern, target):
+    """Add an extractor ("module:Class") for urls matching pattern."""
+    EXTRACTORS.append((pattern, target))
+
+
+def plugins():
+    """(pattern, target) of the extractors of other packages."""
+    global _plugins
+    if _plugins is None:
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            _plugins = []
+            return _plugins
+        found = entry_points()
+        group = found.select(group=ENTRY_POINT_GROUP) \
+            if hasattr(found, 'select') else found.get(ENTRY_POINT_GROUP, [])
+        _plugins = [(entry.name, entry.value) for entry in group]
+    return _plugins
+
+
+def load(target):
+    """Import the class of a "module:Class" target (once)."""
+    if target not in _classes:
+        module, name = target.split(':')
+        _classes[target] = getattr(
+            importlib.import_module(module, __package__), name)
+    return _classes[target]
+
+
+def extractor(comic_url):
+    """Return the comic class for the url (None if unsupported).
+
+    Built-in extractors are tried first; installed packages are only
+    looked up for urls none of them supports.
+    """
+    for pattern, target in EXTRACTORS:
+        if re.search(pattern, comic_url):
+            return load(target)
+    for pattern, target in plugins():
+        if re.search(pattern, comic_url):
+            return load(target)
+    return None
 
 
 def comic(comic_url, args, verify_https):
     """Send the approriate class."""
-    if 'mangafox' in comic_url:
-        return MangaFoxComic(comic_url, args, verify_https)
-    elif 'mangahere' in comic_url:
-        return MangaHereComic(comic_url, args, verify_https)
-    elif ('mangstream' in comic_url) or ('readms' in comic_url):
-        return MangaStreamComic(comic_url, args, verify_https)
-    elif ('mangareader' in comic_url):
-        return MangaReaderComic(comic_url, args, verify_https)
+    comic_class = extractor(comic_url)
+    if comic_class:
+        return comic_class(comic_url, args, verify_https)
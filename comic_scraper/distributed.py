@@ -0,0 +1,200 @@
+"""Distributed downloads: chapters are published to a job queue and
+downloaded by workers on any number of machines.
+
+A coordinator publishes a 'chapter' job per chapter to download. A
+worker running a chapter job finds the chapter's pages and queues a
+'page' job for each; the worker that completes the last page of a
+chapter packs it. Workers must share the download location (e.g. over
+NFS), where pages are saved until their chapter is packed.
+"""
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from . import current_comic
+
+# Seconds a worker holds a job before other workers may take it over
+LEASE = 300
+# Seconds an idle worker waits before asking for jobs again
+POLL_TIME = 2
+# Comics a worker keeps open (with their sessions and manifests)
+OPEN_COMICS = 8
+# Leases are renewed this many times per lease while their jobs run
+RENEWALS = 3
+
+
+def publish(comic, queue):
+    """Queue a 'chapter' job for each chapter to download of comic.
+
+    Returns the number of chapters queued.
+    """
+    chapters = comic.chapters_to_download
+    chapter_class = '%s:%s' % (chapters.chapter_class.__module__,
+                               chapters.chapter_class.__name__)
+    queue.publish([('chapter', comic.url, chapter_num,
+                    {'url': chapters.urls[chapter_num],
+                     'class': chapter_class})
+                   for chapter_num in chapters])
+    return len(chapters)
+
+
+class Worker:
+    """Run the jobs of a queue on threads until none are left."""
+
+    def __init__(self, queue, program_args, lease=LEASE):
+        """Set the queue and the download options of its comics."""
+        self.queue = queue
+        self.program_args = program_args
+        self.threads = program_args.chapterthreads * program_args.pagethreads
+        self.lease = lease
+        self.name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.comics = OrderedDict()
+        self.lock = threading.Lock()
+        # Jobs being run (job id: job), whose leases are renewed
+        self.running = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Work until the queue has no queued or claimed jobs left."""
+        threads = [threading.Thread(target=self.work)
+                   for _ in range(self.threads)]
+        heartbeat = threading.Thread(target=self.heartbeat, daemon=True)
+        heartbeat.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stopped.set()
+        heartbeat.join()
+
+    def heartbeat(self):
+        """Renew the leases of running jobs until the worker stops.
+
+        A job outlasting its lease (e.g. a pack waiting for the packer)
+        is then never handed to another worker while this one is alive.
+        """
+        while not self.stopped.wait(self.lease / RENEWALS):
+            with self.lock:
+                jobs = list(self.running.values())
+            for job in jobs:
+                try:
+                    self.queue.renew(job, self.name, self.lease)
+                except Exception as exc:
+                    print('Could not renew the lease of job %d: %s'
+                          % (job.id, exc))
+
+    def work(self):
+        """Claim and run jobs (on one thread)."""
+        while True:
+            job = self.queue.claim(self.name, self.lease)
+            if job is None:
+                counts = self.queue.counts()
+                if not counts.get('queued') and not counts.get('claimed'):
+                    return
+                # Jobs are waiting for a retry, or for other workers
+                time.sleep(POLL_TIME)
+                continue
+            # Completing a chapter's last page hands over its packing
+            while job:
+                with self.lock:
+                    self.running[job.id] = job
+                try:
+                    next_job = self.run_job(job)
+                finally:
+                    with self.lock:
+                        del self.running[job.id]
+                job = next_job
+
+    def comic(self, comic_url):
+        """Comic object of a url (kept open for the next jobs)."""
+        with self.lock:
+            comic = self.comics.pop(comic_url, None)
+            if comic is None:
+                comic = current_comic.comic(
+                    comic_url, self.program_args,
+                    urlparse(comic_url).scheme == 'https')
+            self.comics[comic_url] = comic
+            if len(self.comics) > OPEN_COMICS:
+                self.comics.popitem(last=False)
+            return comic
+
+    def chapter(self, job):
+        """Chapter object of a job (without fetching the comic index)."""
+        chapter_class = current_comic.load(job.payload['class'])
+        chapter = chapter_class(self.comic(job.comic), job.chapter_num,
+                                job.payload['url'])
+        # The chapter's jobs share its retries, whichever worker runs them
+        chapter.retry_budget = QueueRetryBudget(
+            self.queue, job, self.program_args.chapterretries)
+        return chapter
+
+    def run_job(self, job):
+        """Run a claimed job, return the job it hands over (if any)."""
+        try:
+            chapter = self.chapter(job)
+        except Exception as exc:
+            print('Chapter-%g generated an exception: %s'
+                  % (job.chapter_num, exc))
+            self.queue.fail(job, self.name)
+            return None
+        try:
+            if job.kind == 'chapter':
+                return self.queue.complete(job, self.name, self.lease,
+                                           self.find_pages(job, chapter))
+            elif job.kind == 'page':
+                self.download_page(job, chapter)
+                return self.queue.complete(job, self.name, self.lease)
+            chapter.finish_download()
+            print('Downloaded: Chapter-%g' % (job.chapter_num))
+            return self.queue.complete(job, self.name, self.lease)
+        except Exception as exc:
+            delay = chapter.retry_delay(exc, job.attempt)
+            if delay is not None:
+                self.queue.retry(job, self.name, delay)
+            elif job.kind == 'page':
+                # A failing page does not fail the chapter
+                try:
+                    chapter.save_placeholder(job.payload['page'])
+                except Exception as exc:
+                    print('Chapter-%g generated an exception: %s'
+                          % (job.chapter_num, exc))
+                return self.queue.complete(job, self.name, self.lease)
+            else:
+                print('Chapter-%g generated an exception: %s'
+                      % (job.chapter_num, exc))
+                self.queue.fail(job, self.name)
+
+    def find_pages(self, job, chapter):
+        """Page jobs of a chapter job."""
+        pages = chapter.parsed(chapter.get_pages)
+        os.makedirs(chapter.chapter_location, exist_ok=True)
+        # Image urls found along with the pages save their page html
+        return [('page', job.comic, job.chapter_num,
+                 dict(job.payload, page_url=page_url, page=page_num,
+                      image=chapter.image_urls.get(page_num)))
+                for page_url, page_num in pages]
+
+    def download_page(self, job, chapter):
+        """Save the page of a page job in the chapter location."""
+        page_num = job.payload['page']
+        if job.payload['image']:
+            chapter.image_urls[page_num] = job.payload['image']
+        chapter.fetch_page((job.payload['page_url'], page_num))
+        # The page is only done once transformed
+        chapter.wait_transforms()
+
+
+class QueueRetryBudget:
+    """Retries of a chapter, counted in the queue (see RetryBudget)."""
+
+    def __init__(self, queue, job, retries):
+        """Set the queue and job of the chapter, and its retries."""
+        self.queue = queue
+        self.job = job
+        self.retries = retries
+
+    def spend(self):
+        """Take one retry from the budget, if any is left."""
+        return self.queue.spend_retry(self.job, self.retries)
@@ -1,16 +1,15 @@
 """Extractor for mangafox.me."""
 
-from base_comic import BaseComic, BaseChapter
+from ..base_comic import BaseComic, BaseChapter, ChapterIndex, ParseError
 from urllib.parse import urlparse, urljoin
-import requests
 import bs4 as bsoup
-from collections import defaultdict
 import re
-import os
-import shutil
-from random import shuffle, uniform
-from copy import deepcopy
-from time import sleep
+from random import shuffle
+from ..parsers import make_soup, find_image_src
+
+# Fast path to the page image (<img id="image" ...>)
+IMAGE_TAG = re.compile(
+    r'(?P<img><img\b[^>]*\bid\s*=\s*(["\']?)image\2(?=[\s/>])[^>]*>)', re.I)
 
 
 class MangaFoxComic(BaseComic):
@@ -23,10 +22,9 @@ class MangaFoxComic(BaseComic):
         urlscheme = urlparse(url)
 
         # Get chapters
-        r = requests.get(url, verify=self.verify_https)
-        soup = bsoup.BeautifulSoup(r.text, 'html.parser')
+        soup = make_soup(self.fetch_index(), bsoup.SoupStrainer('a'))
 
-        chapters = defaultdict(MangaFoxChapter)
+        chapters = ChapterIndex(self, MangaFoxChapter)
         links = [link.get('href')
                  for link in soup.find_all('a')
                  if link.get('href') and
@@ -43,8 +41,7 @@ class MangaFoxComic(BaseComic):
                 if chapter_num in chapters:
                     continue
                 else:
-                    chapters[chapter_num] = MangaFoxChapter(
-                        self, chapter_num, chapter_link)
+                    chapters.add(chapter_num, chapter_link)
 
         return chapters
 
@@ -52,72 +49,47 @@ class MangaFoxComic(BaseComic):
 class MangaFoxChapter(BaseChapter):
     """Base chapter class."""
 
+    __slots__ = ()
+
     def get_pages(self):
         """Obtain list of pages in a manga chapter."""
-        # Get base url
-        base_url = self.chapter_url + '/1.html'
-        max_retries = deepcopy(self.max_retries)
-        wait_retry_time = deepcopy(self.wait_time)
-
-        while True:
-            # Get javascript blocks
-            r = requests.get(base_url, verify=self.verify_https)
-            soup = bsoup.BeautifulSoup(r.text, 'html.parser')
-            scripts = [script for script in soup.find_all(
-                'script', attrs={'type': 'text/javascript'})]
-
-            if scripts:
-                # Get total pages
-                for script in scripts:
-                    if script.contents:
-                        matched_groups = re.search(
-                            'var total_pages\s?=\s?(\d*)\s?;',
-                            script.contents[0])
-                        if matched_groups:
-                            total_pages = int(matched_groups.group(1))
-                            break
-                # Get page urls
-                page_urls = ["%s/%d.html" % (self.chapter_url, i + 1)
-                             for i in range(total_pages)]
-                page_num = [i + 1 for i in range(total_pages)]
-                pages = list(zip(page_urls, page_num))
-                shuffle(pages)
-
-                return True, pages
-
-            elif (max_retries > 0):
-                # Idea from manga_downloader (which in turn was from wget)
-                sleep(uniform(0.5 * wait_retry_time, 1.5 * wait_retry_time))
-                max_retries -= 1
-            else:
-                return False, None
-
-    def download_page(self, page):
-        """Download individual pages in a manga."""
-        page_url, page_num = page
-        filename = os.path.join(self.chapter_location,
-                                '%0.3d.jpg' % (page_num))
-
-        max_retries = deepcopy(self.max_retries)
-        wait_retry_time = deepcopy(self.wait_time)
-
-        while True:
-            r = requests.get(page_url, verify=self.verify_https)
-            soup = bsoup.BeautifulSoup(r.text, 'html.parser')
+        # Get javascript blocks
+        html = self.fetch_html(self.chapter_url + '/1.html')
+        soup = make_soup(html, bsoup.SoupStrainer('script'))
+        scripts = [script for script in soup.find_all(
+            'script', attrs={'type': 'text/javascript'})]
+
+        # Get total pages
+        total_pages = None
+        for script in scripts:
+            if script.contents:
+                matched_groups = re.search(
+                    'var total_pages\s?=\s?(\d*)\s?;',
+                    script.contents[0])
+                if matched_groups:
+                    total_pages = int(matched_groups.group(1))
+                    break
+        if not total_pages:
+            raise ParseError('Unable to obtain pages in the chapter')
+
+        # Get page urls
+        page_urls = ["%s/%d.html" % (self.chapter_url, i + 1)
+                     for i in range(total_pages)]
+        page_num = [i + 1 for i in range(total_pages)]
+        pages = list(zip(page_urls, page_num))
+        shuffle(pages)
+        self.resolve_images(html, pages)
+
+        return pages
+
+    def find_image(self, html, page_url):
+        """Find the image url in the html of a page."""
+        image = find_image_src(html, IMAGE_TAG)
+        if not image:
+            soup = make_soup(html, bsoup.SoupStrainer('img'))
             img = soup.find_all('img', attrs={'id': 'image'})
-            if img:
-                image = img[0].get('src')
-                self.download_image(image, filename)
-                return True
-            elif (max_retries > 0):
-                # Idea from manga_downloader (which in turn was from wget)
-                sleep(uniform(0.5 * wait_retry_time, 1.5 * wait_retry_time))
-                max_retries -= 1
-            else:
-                print("Failed download: Chapter-%g, page-%d"
-                      % (self.chapter_num, page_num))
-                shutil.copyfile(
-                    os.path.join(os.path.dirname(
-                        os.path.realpath(__file__)), 'no_image_available.png'),
-                    filename)
-                return False
+            if not img:
+                raise ParseError('No image in %s' % (page_url))
+            image = img[0].get('src')
+
+        return image
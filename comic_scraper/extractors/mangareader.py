@@ -1,16 +1,16 @@
 """Extractor for mangastream.com."""
 
-from base_comic import BaseComic, BaseChapter
+from ..base_comic import BaseComic, BaseChapter, ChapterIndex, ParseError
 from urllib.parse import urlparse, urljoin
-import requests
 import bs4 as bsoup
-from collections import defaultdict
 import re
-import os
-import shutil
-from random import shuffle, uniform
-from copy import deepcopy
-from time import sleep
+from random import shuffle
+from ..parsers import make_soup, find_image_src
+
+# Fast path to the page image (first img in <div id="imgholder">)
+IMAGE_TAG = re.compile(
+    r'<div\b[^>]*\bid\s*=\s*(["\']?)imgholder\1(?=[\s/>])[^>]*>'
+    r'(?:(?!</div>).)*?(?P<img><img\b[^>]*>)', re.I | re.S)
 
 class MangaReaderComic(BaseComic):
     """Base comic class."""
@@ -22,10 +22,9 @@ class MangaReaderComic(BaseComic):
         urlscheme = urlparse(url)
 
         # Get chapters
-        r = requests.get(url, verify=self.verify_https)
-        soup = bsoup.BeautifulSoup(r.text, 'html.parser')
+        soup = make_soup(self.fetch_index(), bsoup.SoupStrainer('a'))
 
-        chapters = defaultdict(MangaReaderChapter)
+        chapters = ChapterIndex(self, MangaReaderChapter)
         links = [link.get('href')
                  for link in soup.find_all('a')
                  if link.get('href') and
@@ -41,8 +40,7 @@ class MangaReaderComic(BaseComic):
                 if chapter_num in chapters:
                     continue
                 else:
-                    chapters[chapter_num] = MangaReaderChapter(
-                        self, chapter_num, chapter_link)
+                    chapters.add(chapter_num, chapter_link)
 
         return chapters
 
@@ -57,79 +55,50 @@ def page_filter(tag):
 class MangaReaderChapter(BaseChapter):
     """Base chapter class."""
 
-
+    __slots__ = ()
 
     def get_pages(self):
-        """Obtain list of pages in a manga chapter."""        
-        # Get base url
-        base_url = self.chapter_url
-        max_retries = deepcopy(self.max_retries)
-        wait_retry_time = deepcopy(self.wait_time)
+        """Obtain list of pages in a manga chapter."""
         # Obtain match url
-        urlscheme = urlparse(base_url)
-
-        while True:
-            # Get javascript blocks
-            r = requests.get(base_url, verify=self.verify_https)
-            soup = bsoup.BeautifulSoup(r.text, 'html.parser')
-
-            page_list = soup.find_all(page_filter)
-
-            pages = []
-            for page in page_list:
-                curr_url = page.get('value')
-                try:
-                    page_num = float(curr_url.split('/')[-1])
-                except:
-                    page_num = 1
-                page_url = urljoin(urlscheme.scheme
-                                   + "://" + urlscheme.netloc, curr_url)
-                pages.append((page_url, page_num))
-
-            if pages:
-                shuffle(pages)
-                return True, pages
-
-            elif (max_retries > 0):
-                # Idea from manga_downloader (which in turn was from wget)
-                sleep(uniform(0.5 * wait_retry_time, 1.5 * wait_retry_time))
-                max_retries -= 1
-            else:
-                return False, None
-
-    def download_page(self, page):
-        """Download individual pages in a manga."""
-        page_url, page_num = page
+        urlscheme = urlparse(self.chapter_url)
+
+        html = self.fetch_html(self.chapter_url)
+        soup = make_soup(html, bsoup.SoupStrainer('select'))
+        page_list = soup.find_all(page_filter)
+
+        pages = []
+        for page in page_list:
+            curr_url = page.get('value')
+            try:
+                page_num = float(curr_url.split('/')[-1])
+            except:
+                page_num = 1
+            page_url = urljoin(urlscheme.scheme
+                               + "://" + urlscheme.netloc, curr_url)
+            pages.append((page_url, page_num))
+
+        if not pages:
+            raise ParseError('Unable to obtain pages in the chapter')
+
+        shuffle(pages)
+        self.resolve_images(html, pages)
+        return pages
+
+    def find_image(self, html, page_url):
+        """Find the image url in the html of a page."""
         urlscheme = urlparse(page_url)
-        filename = os.path.join(self.chapter_location,
-                                '%0.3d.jpg' % (page_num))
-
-        max_retries = deepcopy(self.max_retries)
-        wait_retry_time = deepcopy(self.wait_time)
 
-        while True:
-            r = requests.get(page_url, verify=self.verify_https)
-            soup = bsoup.BeautifulSoup(r.text, 'html.parser')
+        image = find_image_src(html, IMAGE_TAG)
+        if not image:
+            soup = make_soup(html, bsoup.SoupStrainer('div', id='imgholder'))
+            img = []
             for div in soup.find_all('div', {'id':'imgholder'}):
                 if div.get('id'):
-                        img = div.find_all('img')
-                        break
-
-            if img:
-                image = urljoin(urlscheme.scheme
-                                + "://" + urlscheme.netloc,
-                                img[0].get('src'))
-                self.download_image(image, filename)
-                return True
-            elif (max_retries > 0):
-                # Idea from manga_downloader (which in turn was from wget)
-                sleep(uniform(0.5 * wait_retry_time, 1.5 * wait_retry_time))
-                max_retries -= 1
-            else:
-                print("Failed download: Chapter-%g, page-%d"
-                      % (self.chapter_num, page_num))
-                shutil.copyfile(
-                    os.path.join(os.path.dirname(
-                        os.path.realpath(__file__)), 'no_image_available.png'),
-                    filename)
-                return False
+                    img = div.find_all('img')
+                    break
+            if not img:
+                raise ParseError('No image in %s' % (page_url))
+            image = img[0].get('src')
+
+        return urljoin(urlscheme.scheme
+                       + "://" + urlscheme.netloc, image)
@@ -0,0 +1,179 @@
+"""On-disk cache of html responses (chapter indexes and pages)."""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from .shared import FolderRegistry, cache_dir
+
+# Default cache location
+CACHE_DIR = cache_dir('http')
+
+MAX_AGE = re.compile(r'max-age\s*=\s*(\d+)')
+
+
+class HttpCache:
+    """Html responses kept on disk, honoring Cache-Control and validators.
+
+    A response is served from disk while fresh: for max-age seconds if
+    the server sent Cache-Control max-age, otherwise for the ttl given
+    by the caller (per resource type). A stale response is revalidated
+    with its ETag / Last-Modified, so an unchanged page costs a 304.
+    no-store responses are never kept, no-cache ones are always
+    revalidated. Once the cache grows over max_size bytes the least
+    recently used responses are evicted.
+
+    Responses fetched within deferred() are only kept once the caller
+    has parsed them.
+    """
+
+    def __init__(self, folder, max_size):
+        """Open (or create) the cache in folder."""
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Responses of the deferred() block of each thread
+        self.local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+        self.size = sum(entry.stat().st_size
+                        for entry in os.scandir(folder) if entry.is_file())
+
+    def entry_path(self, url):
+        """Path of the cache entry of url."""
+        return os.path.join(self.folder,
+                            hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def fetch(self, session, url, ttl):
+        """Return the html of url, from the cache when possible.
+
+        Raises requests.HTTPError on an error status.
+        """
+        path = self.entry_path(url)
+        entry = self.load(path)
+        now = time.time()
+        if entry and now < entry['expires']:
+            try:
+                os.utime(path)
+            except OSError:
+                # Evicted meanwhile
+                pass
+            self.keep(path, None)
+            return entry['text']
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        r = session.get(url, headers=headers)
+
+        if entry and r.status_code == 304:
+            entry['expires'] = now + self.freshness(r, ttl)
+            self.keep(path, entry)
+            return entry['text']
+        r.raise_for_status()
+
+        cache_control = r.headers.get('Cache-Control', '').lower()
+        self.keep(path, {
+            'url': url,
+            'text': r.text,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'expires': now + self.freshness(r, ttl)}
+            if 'no-store' not in cache_control else None)
+        return r.text
+
+    @contextmanager
+    def deferred(self):
+        """Keep the responses fetched within only if the block succeeds.
+
+        If the block raises (e.g. an error page served with a 200 did not
+        parse), its responses are dropped from the cache instead, so a
+        retry fetches them again.
+        """
+        outer = getattr(self.local, 'pending', None)
+        pending = self.local.pending = []
+        try:
+            yield
+        except BaseException:
+            for path, _ in pending:
+                self.remove(path)
+            raise
+        finally:
+            self.local.pending = outer
+        for path, entry in pending:
+            self.keep(path, entry)
+
+    def keep(self, path, entry):
+        """Store a fetched entry (None if unchanged or not to be kept),
+        or hold it until the deferred() block ends."""
+        pending = getattr(self.local, 'pending', None)
+        if pending is not None:
+            pending.append((path, entry))
+        elif entry:
+            self.store(path, entry)
+
+    def discard(self, url):
+        """Drop the cache entry of url (if any)."""
+        self.remove(self.entry_path(url))
+
+    def freshness(self, response, ttl):
+        """Seconds a response stays fresh."""
+        cache_control = response.headers.get('Cache-Control', '').lower()
+        if 'no-cache' in cache_control:
+            return 0
+        max_age = MAX_AGE.search(cache_control)
+        return int(max_age.group(1)) if max_age else ttl
+
+    def load(self, path):
+        """Load a cache entry (None if missing or unreadable)."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, path, entry):
+        """Write a cache entry and evict old ones if over max_size."""
+        partname = '%s.%d.%d.part' % (path, os.getpid(),
+                                      threading.get_ident())
+        with open(partname, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        size = os.path.getsize(partname)
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(partname, path)
+            self.size += size - old_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def remove(self, path):
+        """Remove a cache entry (if any)."""
+        with self.lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return
+            self.size -= size
+
+    def evict(self):
+        """Remove least recently used entries until under max_size."""
+        entries = sorted((entry for entry in os.scandir(self.folder)
+                          if entry.name.endswith('.json')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+# One cache per folder, shared by every comic of the process
+open_cache = FolderRegistry(HttpCache).open
@@ -0,0 +1,117 @@
+"""Content-addressed image cache shared across chapters and comics."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from .shared import FolderRegistry, cache_dir
+
+# Default cache location
+CACHE_DIR = cache_dir('images')
+
+
+class ImageCache:
+    """Images stored once per content hash, looked up by url.
+
+    Blobs live in <folder>/<sha1[:2]>/<sha1>; a sqlite index maps urls to
+    blobs and keeps blob sizes and last use, so the least recently used
+    blobs are evicted once the cache grows over max_size bytes.
+    """
+
+    def __init__(self, folder, max_size):
+        """Open (or create) the cache in folder."""
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(folder, 'index.sqlite'),
+                                  check_same_thread=False, timeout=60)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS urls '
+                            '(url TEXT PRIMARY KEY, sha1 TEXT NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS blobs '
+                            '(sha1 TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                            'last_used REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS blobs_last_used '
+                            'ON blobs (last_used)')
+
+    def blob_path(self, sha1):
+        """Path of the blob with the given hash."""
+        return os.path.join(self.folder, sha1[:2], sha1)
+
+    def get(self, url):
+        """Return the blob path of a cached url (or None)."""
+        with self.lock:
+            row = self.db.execute('SELECT sha1 FROM urls WHERE url = ?',
+                                  (url,)).fetchone()
+            if row is None:
+                return None
+            path = self.blob_path(row[0])
+            if not os.path.exists(path):
+                # Blob removed behind our back
+                with self.db:
+                    self.forget(row[0])
+                return None
+            with self.db:
+                self.db.execute('UPDATE blobs SET last_used = ? '
+                                'WHERE sha1 = ?', (time.time(), row[0]))
+            return path
+
+    def put(self, url, data):
+        """Cache the image data of url."""
+        self.add(url, hashlib.sha1(data).hexdigest(), len(data),
+                 lambda f: f.write(data))
+
+    def put_file(self, url, filename, sha1):
+        """Cache the image of url saved in filename (with its sha1)."""
+        def copy(f):
+            with open(filename, 'rb') as image:
+                while True:
+                    chunk = image.read(2 ** 16)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+        self.add(url, sha1, os.path.getsize(filename), copy)
+
+    def add(self, url, sha1, size, write):
+        """Store a blob (unless already stored) and map url to it."""
+        path = self.blob_path(sha1)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partname = '%s.%d.%d.part' % (path, os.getpid(),
+                                          threading.get_ident())
+            with open(partname, 'wb') as f:
+                write(f)
+            os.replace(partname, path)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)',
+                            (sha1, size, time.time()))
+            self.db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)',
+                            (url, sha1))
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used blobs until under max_size."""
+        total = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        if total <= self.max_size:
+            return
+        for sha1, size in self.db.execute(
+                'SELECT sha1, size FROM blobs ORDER BY last_used').fetchall():
+            if total <= self.max_size:
+                break
+            self.forget(sha1)
+            try:
+                os.remove(self.blob_path(sha1))
+            except OSError:
+                pass
+            total -= size
+
+    def forget(self, sha1):
+        """Drop a blob and the urls pointing to it from the index."""
+        self.db.execute('DELETE FROM urls WHERE sha1 = ?', (sha1,))
+        self.db.execute('DELETE FROM blobs WHERE sha1 = ?', (sha1,))
+
+
+# One cache per folder, shared by every comic of the process
+open_cache = FolderRegistry(ImageCache).open
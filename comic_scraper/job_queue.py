@@ -0,0 +1,250 @@
+"""Job queue shared by the workers of a distributed download."""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# A claimed job. kind is 'chapter' (find the pages of a chapter), 'page'
+# (download a page) or 'finish' (pack a chapter); payload is a dict.
+Job = namedtuple('Job', ['id', 'kind', 'comic', 'chapter_num', 'payload',
+                         'attempt'])
+
+# Claim order of job kinds (lower first), so started chapters finish
+# before new ones begin
+PRIORITY = {'finish': 0, 'page': 1, 'chapter': 2}
+
+
+class JobQueue:
+    """Interface of queue backends (see SqliteQueue).
+
+    Jobs are claimed with a lease: a job whose worker does not complete,
+    retry or fail it before the lease runs out (e.g. because the worker
+    died) is handed to the next worker that asks. The queue also counts
+    the pages left in each chapter, so the worker completing the last
+    one is handed the chapter's 'finish' job.
+    """
+
+    def publish(self, jobs):
+        """Queue (kind, comic, chapter_num, payload) jobs."""
+        raise NotImplementedError
+
+    def claim(self, worker, lease):
+        """Claim the next ready job for lease seconds (None if none)."""
+        raise NotImplementedError
+
+    def complete(self, job, worker, lease, jobs=()):
+        """Mark a claimed job done and queue the jobs it produced.
+
+        The page jobs of a 'chapter' job are its chapter's pages.
+        Completing a chapter's last page (or a chapter without pages)
+        returns its 'finish' job, claimed by worker for lease seconds;
+        otherwise returns None. Returns None as well if the
+        lease of worker was lost (the job is someone else's by now).
+        """
+        raise NotImplementedError
+
+    def renew(self, job, worker, lease):
+        """Extend the lease of a claimed job to lease seconds from now.
+
+        Returns False if worker no longer holds the job.
+        """
+        raise NotImplementedError
+
+    def retry(self, job, worker, delay):
+        """Queue a claimed job again, delay seconds from now."""
+        raise NotImplementedError
+
+    def fail(self, job, worker):
+        """Give up on a claimed job."""
+        raise NotImplementedError
+
+    def spend_retry(self, job, retries):
+        """Take a retry from the chapter of job, which has retries in all.
+
+        Returns False once the chapter has spent them (on any worker).
+        """
+        raise NotImplementedError
+
+    def counts(self):
+        """Number of jobs in each state (queued, claimed, done, failed)."""
+        raise NotImplementedError
+
+
+class SqliteQueue(JobQueue):
+    """Queue in an SQLite database.
+
+    Workers on other machines need the database on a shared file system
+    with working locks; use another backend where there is none.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        ' id INTEGER PRIMARY KEY, kind TEXT, comic TEXT, chapter REAL,'
+        ' payload TEXT, priority INTEGER, state TEXT, worker TEXT,'
+        ' ready REAL, lease REAL, attempt INTEGER)',
+        'CREATE INDEX IF NOT EXISTS jobs_claim'
+        ' ON jobs (state, priority, id)',
+        'CREATE TABLE IF NOT EXISTS chapters ('
+        ' comic TEXT, chapter REAL, pages INTEGER, retries INTEGER DEFAULT 0,'
+        ' PRIMARY KEY (comic, chapter))',
+    )
+
+    def __init__(self, filename):
+        """Open (or create) the queue database."""
+        self.filename = filename
+        # sqlite3 connections cannot be shared by threads
+        self.local = threading.local()
+        with self.transaction() as db:
+            for statement in self.SCHEMA:
+                db.execute(statement)
+            # Queues created before chapters had a retry count
+            if 'retries' not in [column[1] for column in db.execute(
+                    'PRAGMA table_info(chapters)')]:
+                db.execute('ALTER TABLE chapters'
+                           ' ADD COLUMN retries INTEGER DEFAULT 0')
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction on the connection of this thread.
+
+        The database is locked from the start, so two workers never
+        select the same job to claim.
+        """
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(
+                self.filename, timeout=60, isolation_level=None)
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def publish(self, jobs):
+        """Queue (kind, comic, chapter_num, payload) jobs."""
+        with self.transaction() as db:
+            self.insert(db, jobs)
+
+    def insert(self, db, jobs, state='queued', worker=None, lease=None):
+        """Insert jobs within a transaction, return the last job id."""
+        cursor = None
+        for kind, comic, chapter_num, payload in jobs:
+            cursor = db.execute(
+                'INSERT INTO jobs (kind, comic, chapter, payload, priority,'
+                ' state, worker, ready, lease, attempt)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, 0)',
+                (kind, comic, chapter_num, json.dumps(payload),
+                 PRIORITY[kind], state, worker, lease))
+        return cursor.lastrowid if cursor else None
+
+    def claim(self, worker, lease):
+        """Claim the next ready job for lease seconds (None if none)."""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT id, kind, comic, chapter, payload, attempt FROM jobs"
+                " WHERE (state = 'queued' AND ready <= ?)"
+                " OR (state = 'claimed' AND lease < ?)"
+                " ORDER BY priority, id LIMIT 1", (now, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET state = 'claimed', worker = ?,"
+                       " lease = ? WHERE id = ?",
+                       (worker, now + lease, row[0]))
+        return Job(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5])
+
+    def release(self, db, job, worker, state, ready=0, attempt=None):
+        """Move a job of worker to state, return False if not its own."""
+        return db.execute(
+            "UPDATE jobs SET state = ?, ready = ?, attempt = ?"
+            " WHERE id = ? AND state = 'claimed' AND worker = ?",
+            (state, ready, job.attempt if attempt is None else attempt,
+             job.id, worker)).rowcount == 1
+
+    def complete(self, job, worker, lease, jobs=()):
+        """Mark a claimed job done and queue the jobs it produced."""
+        with self.transaction() as db:
+            if not self.release(db, job, worker, 'done'):
+                return None
+            if job.kind == 'chapter':
+                pages = sum(1 for other in jobs if other[0] == 'page')
+                self.add_chapter(db, job)
+                db.execute('UPDATE chapters SET pages = ?'
+                           ' WHERE comic = ? AND chapter = ?',
+                           (pages, job.comic, job.chapter_num))
+                self.insert(db, jobs)
+            elif job.kind == 'page':
+                db.execute('UPDATE chapters SET pages = pages - 1'
+                           ' WHERE comic = ? AND chapter = ?',
+                           (job.comic, job.chapter_num))
+                pages = db.execute('SELECT pages FROM chapters'
+                                   ' WHERE comic = ? AND chapter = ?',
+                                   (job.comic, job.chapter_num)).fetchone()[0]
+            else:
+                return None
+            if pages:
+                return None
+            finish_id = self.insert(
+                db, [('finish', job.comic, job.chapter_num, job.payload)],
+                'claimed', worker, time.time() + lease)
+        return Job(finish_id, 'finish', job.comic, job.chapter_num,
+                   job.payload, 0)
+
+    def renew(self, job, worker, lease):
+        """Extend the lease of a claimed job to lease seconds from now."""
+        with self.transaction() as db:
+            return db.execute(
+                "UPDATE jobs SET lease = ?"
+                " WHERE id = ? AND state = 'claimed' AND worker = ?",
+                (time.time() + lease, job.id, worker)).rowcount == 1
+
+    def retry(self, job, worker, delay):
+        """Queue a claimed job again, delay seconds from now."""
+        with self.transaction() as db:
+            self.release(db, job, worker, 'queued', time.time() + delay,
+                         job.attempt + 1)
+
+    def fail(self, job, worker):
+        """Give up on a claimed job."""
+        with self.transaction() as db:
+            self.release(db, job, worker, 'failed')
+
+    def spend_retry(self, job, retries):
+        """Take a retry from the chapter of job, which has retries in all."""
+        with self.transaction() as db:
+            self.add_chapter(db, job)
+            return db.execute(
+                'UPDATE chapters SET retries = retries + 1'
+                ' WHERE comic = ? AND chapter = ? AND retries < ?',
+                (job.comic, job.chapter_num, retries)).rowcount == 1
+
+    def add_chapter(self, db, job):
+        """Add the row of job's chapter within a transaction (if new)."""
+        db.execute('INSERT OR IGNORE INTO chapters (comic, chapter)'
+                   ' VALUES (?, ?)', (job.comic, job.chapter_num))
+
+    def counts(self):
+        """Number of jobs in each state (queued, claimed, done, failed)."""
+        with self.transaction() as db:
+            return dict(db.execute(
+                'SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+
+# Queue backends by url scheme ('name://...'); plain paths are SQLite
+BACKENDS = {'sqlite': SqliteQueue}
+
+
+def open_queue(location):
+    """Open the queue at location (a path, or a url of a backend)."""
+    scheme = urlparse(location).scheme
+    if scheme in BACKENDS and scheme != 'sqlite':
+        return BACKENDS[scheme](location)
+    if scheme == 'sqlite':
+        location = location[len('sqlite://'):]
+    return SqliteQueue(os.path.abspath(os.path.expanduser(location)))
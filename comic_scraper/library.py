@@ -0,0 +1,250 @@
+"""Library interface: open comics and stream their pages.
+
+    from comic_scraper import open_comic
+
+    with open_comic('http://mangafox.me/manga/kingdom',
+                    location='/tmp/manga') as comic:
+        for page in comic.pages([1, 2]):
+            ingest(page.chapter_num, page.page_num, page.kind, page.data)
+
+Pages are yielded as they arrive (not in page order), either as bytes or,
+with files=True, as the paths of the saved pages. Nothing is packed
+unless download() is called.
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import os
+from collections import namedtuple
+from urllib.parse import urlparse
+from . import current_comic
+from .base_comic import EXTENSIONS
+from .comic_scraper import argument_parser
+
+# A downloaded page: data (bytes) or path (files=True), or the error that
+# kept it from downloading
+Page = namedtuple('Page', ['chapter_num', 'page_num', 'url', 'kind', 'data',
+                           'path', 'error'])
+
+
+class Config:
+    """Download options of a comic.
+
+    The options are the long command line options, with the same
+    defaults (e.g. Config(chapterthreads=2, format='cbz')).
+    """
+
+    def __init__(self, **options):
+        """Set options (the others get their command line default)."""
+        defaults = vars(argument_parser().parse_args([]))
+        del defaults['urls']
+        for name in options:
+            if name not in defaults:
+                raise TypeError('Unknown option: %s' % (name))
+        defaults.update(options)
+        vars(self).update(defaults)
+
+
+def open_comic(comic_url, config=None, **options):
+    """Open a comic without fetching anything yet.
+
+    options override those of config (see Config). Raises ValueError if
+    no extractor supports the url.
+    """
+    comic_class = current_comic.extractor(comic_url)
+    if comic_class is None:
+        raise ValueError('Unsupported comic url: %s' % (comic_url))
+    if config is None:
+        config = Config(**options)
+    elif options:
+        config = Config(**dict(vars(config), **options))
+    # https certificates are verified, unless they turn out invalid (see
+    # session.ComicSession)
+    return Comic(comic_class(comic_url, config,
+                             urlparse(comic_url).scheme == 'https'))
+
+
+class Comic:
+    """A comic opened with open_comic."""
+
+    def __init__(self, comic):
+        """Wrap an extractor's comic object."""
+        self.comic = comic
+        self.name = comic.name
+        self.url = comic.url
+
+    def __enter__(self):
+        """Use the comic as a context manager (closed on exit)."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the comic."""
+        self.close()
+
+    def close(self):
+        """Close the comic's connections."""
+        self.comic.session.close()
+
+    def chapter_nums(self):
+        """Sorted chapter numbers (fetches the chapter index once)."""
+        return sorted(self.comic.all_chapters)
+
+    def chapters(self, chapter_nums=None):
+        """Iterate over the given chapters (default all), in order.
+
+        chapter_nums are chapter numbers or a selection of the -c option
+        (e.g. '10:20,last=3').
+        """
+        index = self.comic.all_chapters
+        for chapter_num in index.select(chapter_nums):
+            yield Chapter(index[chapter_num])
+
+    def pages(self, chapter_nums=None, files=False):
+        """Iterate over the pages of the given chapters, in chapter order.
+
+        See Chapter.pages. A chapter whose pages cannot be found is
+        yielded as a Page without page_num, with its error.
+        """
+        for chapter in self.chapters(chapter_nums):
+            try:
+                pages = chapter.pages(files)
+            except Exception as exc:
+                yield Page(chapter.num, None, None, None, None, None, exc)
+                continue
+            yield from pages
+
+    def apages(self, chapter_nums=None, files=False):
+        """Async iterator over pages(chapter_nums, files)."""
+        return AsyncPages(self.pages(chapter_nums, files))
+
+    def download(self, chapter_nums=None):
+        """Download and pack chapters like the command line does.
+
+        Chapters packed by earlier runs are skipped. Returns the packed
+        files.
+        """
+        self.comic.set_download_chapters(chapter_nums)
+        return [self.comic.chapter_file(chapter_num)
+                for chapter_num in self.comic.download_comic()]
+
+
+class Chapter:
+    """A chapter of a Comic."""
+
+    def __init__(self, chapter):
+        """Wrap an extractor's chapter object."""
+        self.chapter = chapter
+        self.num = chapter.chapter_num
+        self.url = chapter.chapter_url
+
+    def pages(self, files=False):
+        """Iterate over the pages of the chapter as they arrive.
+
+        Pages are downloaded pagethreads at a time, and at most twice as
+        many wait to be consumed. With files=True, pages are saved in the
+        chapter folder (where pages saved by earlier runs are reused) and
+        yielded as paths instead of bytes. A page that keeps failing is
+        yielded with its error.
+        """
+        chapter = self.chapter
+        pages = sorted(chapter.retry(chapter.parsed, chapter.get_pages),
+                       key=lambda page: page[1])
+        if files and not os.path.exists(chapter.chapter_location):
+            os.makedirs(chapter.chapter_location)
+        return streamed(lambda page: self.fetch_page(page, files), pages,
+                        chapter.page_threads)
+
+    def apages(self, files=False):
+        """Async iterator over pages(files)."""
+        return AsyncPages(self.pages(files))
+
+    def download(self):
+        """Download and pack the chapter, return the packed file."""
+        self.chapter.download_chapter()
+        return self.chapter.chapter_file
+
+    def fetch_page(self, page, files):
+        """Download a page (with retries), return it as a Page."""
+        chapter = self.chapter
+        page_num = page[1]
+        try:
+            if files and chapter.is_staged(page_num):
+                record = chapter.manifest.page(chapter.chapter_num, page_num)
+                filename = record.get('file', chapter.page_filename(page_num))
+                extension = os.path.splitext(filename)[1][1:]
+                kind = {ext: kind for kind, ext in EXTENSIONS.items()}.get(
+                    extension, extension)
+                return Page(chapter.chapter_num, page_num, record['url'], kind,
+                            None, os.path.join(chapter.chapter_location,
+                                               filename), None)
+            url = chapter.retry(chapter.get_image_url, page)
+            data, kind = chapter.retry(chapter.fetch_image, url, page_num)
+            if chapter.transform:
+                try:
+                    data, kind = chapter.transform.submit(data, kind).result()
+                except Exception as exc:
+                    print('Transform failed: Chapter-%g, page-%d (%s)'
+                          % (chapter.chapter_num, page_num, exc))
+            if not files:
+                return Page(chapter.chapter_num, page_num, url, kind, data,
+                            None, None)
+            filename = chapter.store_page(page_num, url, kind, data)
+            return Page(chapter.chapter_num, page_num, url, kind, None,
+                        os.path.join(chapter.chapter_location, filename),
+                        None)
+        except Exception as exc:
+            return Page(chapter.chapter_num, page_num, None, None, None,
+                        None, exc)
+
+
+def streamed(func, items, workers):
+    """Yield func(item) for every item, as the calls complete.
+
+    At most 2 * workers calls are running or done but not yet consumed,
+    so a slow consumer holds the downloads back.
+    """
+    items = iter(items)
+    pending = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) \
+            as executor:
+        while True:
+            for item in itertools.islice(items, 2 * workers - len(pending)):
+                pending.add(executor.submit(func, item))
+            if not pending:
+                return
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class AsyncPages:
+    """Async iterator over a page iterator, for asyncio code.
+
+    The page iterator runs in a thread of its own, so the event loop is
+    never blocked by downloads.
+    """
+
+    def __init__(self, pages):
+        """Wrap an iterator (e.g. Chapter.pages())."""
+        self.pages = pages
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def __aiter__(self):
+        """Return the iterator itself."""
+        return self
+
+    async def __anext__(self):
+        """Wait for the next page."""
+        page = await asyncio.get_event_loop().run_in_executor(
+            self.executor, next, self.pages, None)
+        if page is None:
+            self.executor.shutdown(wait=False)
+            raise StopAsyncIteration
+        return page
+
+    async def aclose(self):
+        """Stop the downloads of an iterator that is left unfinished."""
+        await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.pages.close)
+        self.executor.shutdown(wait=False)
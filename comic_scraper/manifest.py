@@ -0,0 +1,85 @@
+"""Persistent record of downloaded pages and packed chapters."""
+import json
+import os
+import threading
+
+
+class Manifest:
+    """Download state of a comic, kept as JSON lines in its location.
+
+    Each line records either a downloaded page (chapter, page, url, size,
+    sha1 and file name of the image) or a packed chapter (chapter and
+    file). Lines are appended as work completes, so a crash loses at
+    most the line being written.
+    """
+
+    def __init__(self, filename, compact=True):
+        """Load the manifest (if any) and compact it (if asked)."""
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.chapters = {}
+        if os.path.exists(filename):
+            self.load()
+        if compact:
+            self.compact()
+
+    def load(self):
+        """Replay the records of the manifest file."""
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partially written last line
+                    continue
+                self.apply(record)
+
+    def apply(self, record):
+        """Update the in-memory state with one record."""
+        if 'index' in record:
+            # Index validators of older runs (now in the html cache)
+            return
+        chapter_num = float(record['chapter'])
+        if 'page' in record:
+            self.pages[(chapter_num, float(record['page']))] = record
+        else:
+            self.chapters[chapter_num] = record
+            # Pages of a packed chapter are no longer needed
+            for key in [key for key in self.pages if key[0] == chapter_num]:
+                del self.pages[key]
+
+    def compact(self):
+        """Rewrite the manifest with only the current state."""
+        with self.lock:
+            partname = self.filename + '.part'
+            with open(partname, 'w') as f:
+                for record in list(self.chapters.values()) + \
+                        list(self.pages.values()):
+                    f.write(json.dumps(record) + '\n')
+            os.replace(partname, self.filename)
+
+    def append(self, record):
+        """Apply a record and append it to the manifest file."""
+        with self.lock:
+            self.apply(record)
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def record_page(self, chapter_num, page_num, url, size, sha1,
+                    filename):
+        """Record a downloaded page (saved as filename)."""
+        self.append({'chapter': chapter_num, 'page': page_num, 'url': url,
+                     'size': size, 'sha1': sha1, 'file': filename})
+
+    def record_chapter(self, chapter_num, filename):
+        """Record a packed chapter."""
+        self.append({'chapter': chapter_num, 'file': filename})
+
+    def page(self, chapter_num, page_num):
+        """Return the record of a downloaded page (or None)."""
+        return self.pages.get((float(chapter_num), float(page_num)))
+
+    def chapter(self, chapter_num):
+        """Return the record of a packed chapter (or None)."""
+        return self.chapters.get(float(chapter_num))
@@ -0,0 +1,243 @@
+"""Timings and counters of a run, with pluggable sinks."""
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Quantiles reported by the summary and the Prometheus endpoint
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics:
+    """Counters and timing samples of a run, labelled by host.
+
+    Counters: requests, errors, bytes, retries, pages, placeholders.
+    Timings (seconds): ttfb (request sent to response headers, including
+    connect), transfer (body read), request (whole request), parse (page
+    html to image urls), transform (page handed to the transform until
+    saved), download (chapter discovered until its pages are saved),
+    pack_wait (chapter waiting for the packer) and pack (pages to
+    cbz/pdf). Timings are kept as histograms, so memory stays the same
+    however long the run. Every observation is also passed to the sinks.
+    """
+
+    def __init__(self):
+        """Start an empty run."""
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(float)
+        self.samples = defaultdict(Histogram)
+        self.sinks = []
+
+    def add_sink(self, sink):
+        """Pass every later observation to sink (see JsonLinesSink)."""
+        self.sinks.append(sink)
+
+    def count(self, name, host, value=1, **fields):
+        """Add value to a counter of host."""
+        with self.lock:
+            self.counters[(name, host)] += value
+        self.emit(name, host, value, fields)
+
+    def observe(self, name, host, seconds, **fields):
+        """Record a timing sample of host."""
+        with self.lock:
+            self.samples[(name, host)].add(seconds)
+        self.emit(name, host, seconds, fields)
+
+    @contextmanager
+    def timer(self, name, host, **fields):
+        """Time the enclosed block as a sample of host."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, host, time.monotonic() - start, **fields)
+
+    def emit(self, name, host, value, fields):
+        """Pass an observation to the sinks."""
+        if not self.sinks:
+            return
+        event = dict(fields, time=time.time(), metric=name, host=host,
+                     value=value)
+        for sink in self.sinks:
+            sink.emit(event)
+
+    def snapshot(self):
+        """Return copies of the counters and timing histograms."""
+        with self.lock:
+            return dict(self.counters), {key: values.copy() for key, values
+                                         in self.samples.items()}
+
+    def total(self, name):
+        """Sum of the timing samples of name, over all hosts."""
+        with self.lock:
+            return sum(values.sum for (other, _), values
+                       in self.samples.items() if other == name)
+
+    def summary(self):
+        """Per-host throughput and latency quantiles, as text."""
+        counters, samples = self.snapshot()
+        elapsed = max(time.time() - self.started, 1e-9)
+        hosts = sorted(set(host for _, host in counters) |
+                       set(host for _, host in samples))
+        lines = ['Metrics (%.1fs):' % (elapsed)]
+        for host in hosts:
+            size = counters.get(('bytes', host), 0)
+            lines.append(
+                '  %s: %d requests, %d errors, %d retries, %d pages, '
+                '%.1f MB (%.2f MB/s)'
+                % (host, counters.get(('requests', host), 0),
+                   counters.get(('errors', host), 0),
+                   counters.get(('retries', host), 0),
+                   counters.get(('pages', host), 0),
+                   size / 2 ** 20, size / 2 ** 20 / elapsed))
+            for name in ('ttfb', 'transfer', 'request', 'parse',
+                         'transform', 'download', 'pack_wait', 'pack'):
+                values = samples.get((name, host))
+                if values:
+                    lines.append(
+                        '    %-9s p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms'
+                        % ((name,) + tuple(values.quantile(q) * 1000
+                                           for q in QUANTILES)))
+        return '\n'.join(lines)
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        counters, samples = self.snapshot()
+        lines = []
+        for name in sorted(set(name for name, _ in counters)):
+            metric = 'comic_scraper_%s_total' % (name)
+            lines.append('# TYPE %s counter' % (metric))
+            for (other, host), value in sorted(counters.items()):
+                if other == name:
+                    lines.append('%s{host="%s"} %g' % (metric, host, value))
+        for name in sorted(set(name for name, _ in samples)):
+            metric = 'comic_scraper_%s_seconds' % (name)
+            lines.append('# TYPE %s summary' % (metric))
+            for (other, host), values in sorted(samples.items()):
+                if other != name:
+                    continue
+                for q in QUANTILES:
+                    lines.append('%s{host="%s",quantile="%g"} %g'
+                                 % (metric, host, q, values.quantile(q)))
+                lines.append('%s_sum{host="%s"} %g'
+                             % (metric, host, values.sum))
+                lines.append('%s_count{host="%s"} %d'
+                             % (metric, host, values.count))
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        """Close the sinks."""
+        for sink in self.sinks:
+            sink.close()
+
+
+class Histogram:
+    """Timing samples counted in fixed, logarithmic buckets.
+
+    Bucket i counts the samples up to MIN_SECONDS * GROWTH ** i (the last
+    one, all longer samples), so quantiles are within 10 % of the exact
+    ones.
+    """
+
+    MIN_SECONDS = 1e-4
+    GROWTH = 1.1
+    # Buckets up to about five hours
+    BUCKETS = 200
+
+    def __init__(self):
+        """Start without samples."""
+        self.buckets = [0] * (self.BUCKETS + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Count a sample."""
+        index = 0 if seconds <= self.MIN_SECONDS else min(
+            self.BUCKETS, int(math.ceil(math.log(seconds / self.MIN_SECONDS) /
+                                        math.log(self.GROWTH))))
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Nearest-rank quantile q (upper bound of its bucket)."""
+        rank = min(self.count - 1, int(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen > rank:
+                return min(self.max, self.MIN_SECONDS * self.GROWTH ** index)
+        return self.max
+
+    def copy(self):
+        """A copy of the histogram."""
+        other = Histogram()
+        other.buckets = list(self.buckets)
+        other.count, other.sum, other.max = self.count, self.sum, self.max
+        return other
+
+
+class JsonLinesSink:
+    """Append every observation as a JSON line to a file."""
+
+    def __init__(self, filename):
+        """Open filename for appending."""
+        self.lock = threading.Lock()
+        self.file = open(filename, 'a')
+
+    def emit(self, event):
+        """Write one observation."""
+        line = json.dumps(event) + '\n'
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        """Flush and close the file."""
+        with self.lock:
+            self.file.close()
+
+
+class PrometheusSink:
+    """Serve the metrics for Prometheus on http://<host>:<port>/metrics."""
+
+    def __init__(self, metrics, port, host='localhost'):
+        """Start serving in a background thread."""
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def emit(self, event):
+        """Observations are read on request, not pushed."""
+
+    def close(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Metrics of the process, shared by every comic
+METRICS = Metrics()
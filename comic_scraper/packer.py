@@ -0,0 +1,59 @@
+"""Chapter packing (cbz / pdf) on a process pool of its own."""
+import os
+import threading
+from .shared import LazyPool
+
+# Packer of the process (created by the first comic)
+_packer = None
+_packer_lock = threading.Lock()
+
+
+def packer(workers=None):
+    """Return the packer of the process, creating it with workers
+    processes (default one per core)."""
+    global _packer
+    with _packer_lock:
+        if _packer is None:
+            _packer = Packer(workers)
+        return _packer
+
+
+class Packer:
+    """Pack chapters on worker processes, so the threads that download
+    pages never wait for (nor share the GIL with) compression and PDF
+    building.
+
+    At most two packs per worker are queued or running; submit blocks
+    beyond that, so finished chapters cannot pile up on disk faster
+    than they are packed.
+    """
+
+    def __init__(self, workers=None):
+        """Set the number of worker processes (started on first use)."""
+        self.workers = workers or os.cpu_count()
+        self.slots = threading.BoundedSemaphore(2 * self.workers)
+        self.pool = LazyPool(self.workers)
+
+    def submit(self, func, *args, budget=None, nbytes=0):
+        """Run func(*args) on a worker process, return its future.
+
+        nbytes are reserved from budget (a MemoryBudget) until it is
+        done.
+        """
+        self.slots.acquire()
+        if budget:
+            budget.acquire(nbytes)
+        try:
+            future = self.pool.get().submit(func, *args)
+        except Exception:
+            self.release(budget, nbytes)
+            raise
+        future.add_done_callback(
+            lambda future: self.release(budget, nbytes))
+        return future
+
+    def release(self, budget, nbytes):
+        """Free the slot (and memory) of a pack."""
+        if budget:
+            budget.release(nbytes)
+        self.slots.release()
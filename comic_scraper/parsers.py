@@ -0,0 +1,50 @@
+"""HTML parsing shared by the extractors."""
+import importlib.util
+import re
+from html import unescape
+import bs4 as bsoup
+
+# Prefer the C-backed lxml parser, fall back to the pure-python one
+PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+# Image list in chapter JS (var images = ["...", ...];)
+IMAGE_LIST = re.compile(
+    r'\b(?:images|pages|chapter_images|lstImages)\s*=\s*\[([^\]]*)\]')
+IMAGE_URL = re.compile(r'''["']([^"']+\.(?:jpe?g|png|gif|webp)[^"']*)["']''',
+                       re.I)
+# Attributes of a start tag
+ATTRIBUTE = re.compile(
+    r'''([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''')
+
+
+def make_soup(html, parse_only=None):
+    """Parse html (only the tags matched by a SoupStrainer, if given)."""
+    return bsoup.BeautifulSoup(html, PARSER, parse_only=parse_only)
+
+
+def tag_attributes(tag):
+    """Return the attributes of a start tag (as text) as a dict."""
+    return {match.group(1).lower(): unescape(
+        next(value for value in match.groups()[1:] if value is not None))
+        for match in ATTRIBUTE.finditer(tag)}
+
+
+def find_image_src(html, pattern):
+    """Fast path: src of the first img tag matched by pattern (or None).
+
+    pattern is a compiled regex whose 'img' group is an img start tag.
+    Extractors fall back to a soup when this finds nothing.
+    """
+    match = pattern.search(html)
+    if not match:
+        return None
+    return tag_attributes(match.group('img')).get('src')
+
+
+def find_image_list(html):
+    """Image urls listed in the chapter JS, in page order (or [])."""
+    match = IMAGE_LIST.search(html)
+    if not match:
+        return []
+    return [unescape(url.replace('\\/', '/'))
+            for url in IMAGE_URL.findall(match.group(1))]
@@ -0,0 +1,94 @@
+"""Pooled HTTP session shared by a comic and its chapters."""
+from urllib.parse import urlparse
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InsecureRequestWarning
+from .throttle import host_throttle
+from .metrics import METRICS
+
+
+class ComicSession(requests.Session):
+    """Keep-alive session with bounded per-host connection pools."""
+
+    def __init__(self, host_connections=10, host_pools=10, verify=True,
+                 rate=None, burst=None, insecure_fallback=False):
+        """Mount pooled adapters.
+
+        host_connections caps the open connections to any single host;
+        requests beyond the cap wait for a pooled connection to be freed.
+        host_pools is the number of per-host pools kept alive at once.
+        Requests to a host are also throttled (see throttle.HostThrottle)
+        to at most rate per second (None for no limit) and to an in-flight
+        limit that adapts to the host's errors and latency.
+        With insecure_fallback, a certificate that cannot be verified
+        turns verification off (once, for the whole session) instead of
+        failing the request.
+        """
+        super().__init__()
+        self.verify = verify
+        self.insecure_fallback = insecure_fallback
+        self.insecure_lock = threading.Lock()
+        self.host_connections = host_connections
+        self.rate = rate
+        self.burst = burst
+        adapter = HTTPAdapter(pool_connections=host_pools,
+                              pool_maxsize=host_connections,
+                              pool_block=True)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        """Send a request once the host's throttle allows it.
+
+        Timings and sizes go to the run metrics; the body of a streamed
+        response is timed by its reader.
+        """
+        host = urlparse(url).netloc
+        throttle = host_throttle(host, self.host_connections,
+                                 self.rate, self.burst)
+        throttle.acquire()
+        start = time.monotonic()
+        try:
+            response = self.send_request(method, url, *args, **kwargs)
+        except Exception as exc:
+            throttle.release()
+            METRICS.count('errors', host, error=type(exc).__name__)
+            raise
+        duration = time.monotonic() - start
+        ttfb = response.elapsed.total_seconds()
+        throttle.release(response, ttfb)
+
+        METRICS.count('requests', host, status=response.status_code)
+        METRICS.observe('ttfb', host, ttfb)
+        if not kwargs.get('stream'):
+            METRICS.count('bytes', host, len(response.content))
+            METRICS.observe('transfer', host, max(0, duration - ttfb))
+            METRICS.observe('request', host, duration,
+                            status=response.status_code)
+        return response
+
+    def send_request(self, method, url, *args, **kwargs):
+        """Send a request, without verification if the certificate fails.
+
+        The first request of a comic doubles as its certificate check, so
+        no separate probe request is needed.
+        """
+        if not self.verify:
+            # Else REQUESTS_CA_BUNDLE would turn verification back on
+            kwargs.setdefault('verify', False)
+        try:
+            return super().request(method, url, *args, **kwargs)
+        except requests.exceptions.SSLError:
+            if not self.insecure_fallback:
+                raise
+            with self.insecure_lock:
+                if self.verify:
+                    self.verify = False
+                    print('Could not validate https certificate for url:' +
+                          '%s. Proceeding with Insecure certificate.' % (url))
+                    requests.packages.urllib3.disable_warnings(
+                        category=InsecureRequestWarning)
+            kwargs['verify'] = False
+            return super().request(method, url, *args, **kwargs)
@@ -0,0 +1,49 @@
+"""Caches and process pools shared by every comic of the process."""
+import atexit
+import concurrent.futures
+import os
+import threading
+
+
+def cache_dir(name):
+    """Default location of a cache (under XDG_CACHE_HOME)."""
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'comic-scraper', name)
+
+
+class FolderRegistry:
+    """One cache_class object per folder, opened on first use."""
+
+    def __init__(self, cache_class):
+        """Open caches as cache_class(folder, *args)."""
+        self.cache_class = cache_class
+        self.caches = {}
+        self.lock = threading.Lock()
+
+    def open(self, folder, *args):
+        """Return the cache of a folder, opening it on first use."""
+        folder = os.path.abspath(os.path.expanduser(folder))
+        with self.lock:
+            if folder not in self.caches:
+                self.caches[folder] = self.cache_class(folder, *args)
+            return self.caches[folder]
+
+
+class LazyPool:
+    """Process pool started on first use and shut down at exit."""
+
+    def __init__(self, workers=None):
+        """Set the number of processes (default one per core)."""
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Return the pool, starting it."""
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers)
+                atexit.register(self.pool.shutdown)
+            return self.pool
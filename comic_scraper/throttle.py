@@ -0,0 +1,215 @@
+"""Per-host request rate limiting and adaptive concurrency."""
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# Seconds between checks for a free slot of a host without blocking
+POLL_INTERVAL = 0.01
+
+
+def congested(response):
+    """Whether a response tells the host is overloaded (a 429 or 5xx)."""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def retry_after(response):
+    """Seconds a response asks to wait before retrying (None if none)."""
+    value = response.headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        date = parsedate_to_datetime(value) if value else None
+    except (TypeError, ValueError):
+        return None
+    if date is None or date.tzinfo is None:
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+class TokenBucket:
+    """Allow rate requests per second on average, bursts of burst."""
+
+    def __init__(self, rate, burst):
+        """Start with a full bucket."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def take(self):
+        """Take a token if one is available.
+
+        Returns 0 if it was taken, else the seconds until one will be.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class AdaptiveLimit:
+    """AIMD limit on the requests in flight to one host.
+
+    Every successful request raises the limit by 1/limit (about one per
+    round of requests). A throttling or server error status (429, 5xx), a
+    failed request or time to first byte growing well above the usual
+    one halves it, at most once per round trip.
+
+    The usual time to first byte is a low percentile of the last window
+    requests, so it follows the host as it changes and a single fast
+    response (e.g. a 304) does not make every later one look slow.
+    """
+
+    def __init__(self, max_limit, min_limit=1, latency_factor=3,
+                 window=50):
+        """Start at the maximum limit."""
+        self.limit = float(max_limit)
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_factor = latency_factor
+        self.inflight = 0
+        self.latencies = deque(maxlen=window)
+        self.latency = None
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+
+    def try_acquire(self):
+        """Count a request in flight if the limit allows it (no wait)."""
+        with self.condition:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            return True
+
+    def cancel(self):
+        """Give back a slot whose request was not sent."""
+        with self.condition:
+            self.inflight -= 1
+            self.condition.notify_all()
+
+    def release(self, ok, latency=None):
+        """Adjust the limit with the outcome of a finished request."""
+        with self.condition:
+            self.inflight -= 1
+            if latency is not None:
+                self.latencies.append(latency)
+                self.latency = latency if self.latency is None \
+                    else 0.8 * self.latency + 0.2 * latency
+            baseline = self.baseline()
+            congested = not ok or (
+                baseline is not None and
+                self.latency > self.latency_factor * baseline)
+
+            now = time.monotonic()
+            if not congested:
+                self.limit = min(self.max_limit,
+                                 self.limit + 1 / self.limit)
+            elif now - self.last_decrease > (self.latency or 0):
+                self.limit = max(self.min_limit, self.limit / 2)
+                self.last_decrease = now
+            self.condition.notify_all()
+
+    def baseline(self):
+        """Usual time to first byte (None until there are enough)."""
+        if len(self.latencies) < 10:
+            return None
+        return sorted(self.latencies)[len(self.latencies) // 10]
+
+
+class HostThrottle:
+    """Rate limit and adaptive concurrency of one host.
+
+    A Retry-After sent by the host pauses all requests to it, whether or
+    not a rate limit is set.
+    """
+
+    def __init__(self, max_inflight, rate=None, burst=None):
+        """Set up the limiters (rate None for no rate limit)."""
+        self.bucket = TokenBucket(rate, burst or max(1, rate)) \
+            if rate else None
+        self.limit = AdaptiveLimit(max_inflight)
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request to the host may be sent."""
+        while True:
+            with self.lock:
+                wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self.limit.acquire()
+        if self.bucket:
+            try:
+                self.bucket.acquire()
+            except BaseException:
+                self.limit.release(True)
+                raise
+
+    def try_acquire(self):
+        """Let a request be sent now, if the host allows it.
+
+        Returns 0 if it may be sent, else the seconds to wait before
+        trying again (for callers that must not block, e.g. on an event
+        loop).
+        """
+        with self.lock:
+            wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if not self.limit.try_acquire():
+            return POLL_INTERVAL
+        wait = self.bucket.take() if self.bucket else 0
+        if wait:
+            self.limit.cancel()
+        return wait
+
+    def release(self, response=None, latency=None):
+        """Report a finished request (response None if it failed)."""
+        ok = response is not None and not congested(response)
+        if not ok and response is not None:
+            pause = retry_after(response)
+            if pause:
+                self.pause(pause)
+        self.limit.release(ok, latency)
+
+    def pause(self, seconds):
+        """Send no requests to the host for the given time."""
+        with self.lock:
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + seconds)
+
+
+# Throttles are shared by every session (and comic) of the process
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def host_throttle(host, max_inflight, rate=None, burst=None):
+    """Return the throttle of a host, creating it on first use."""
+    with _throttles_lock:
+        if host not in _throttles:
+            _throttles[host] = HostThrottle(max_inflight, rate, burst)
+        return _throttles[host]
@@ -0,0 +1,74 @@
+"""Page transforms (downscale, grayscale, re-encode) on a process pool."""
+import io
+import os
+import threading
+from .shared import LazyPool
+
+# Process pool for page transforms (one worker per core)
+process_pool = LazyPool().get
+
+
+class Transform:
+    """Settings of the page transform, applied on the process pool.
+
+    Pages larger than max_width x max_height are downscaled (keeping
+    their aspect ratio), converted to grayscale if asked and re-encoded
+    as JPEG at the given quality.
+    """
+
+    def __init__(self, max_width=None, max_height=None, grayscale=False,
+                 quality=85):
+        """Set the transform."""
+        self.options = (max_width, max_height, grayscale, quality)
+        # Pages waiting for (or in) the pool, two per core at most
+        self.slots = threading.BoundedSemaphore(2 * os.cpu_count())
+
+    def submit(self, data, kind):
+        """Transform image data (of format kind) in the background.
+
+        Returns a future of the new (data, kind). Blocks while the pool
+        is busy, so downloads cannot pile pages up in memory.
+        """
+        self.slots.acquire()
+        try:
+            future = process_pool().submit(transform_image, data, kind,
+                                           *self.options)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self.slots.release())
+        return future
+
+
+def transform_image(data, kind, max_width, max_height, grayscale, quality):
+    """Transform image data, return the new data and its format.
+
+    The original is kept if it is neither downscaled nor converted and
+    re-encoding would not make it smaller.
+    """
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        changed = False
+        if (max_width and image.width > max_width) or \
+                (max_height and image.height > max_height):
+            image.thumbnail((max_width or image.width,
+                             max_height or image.height), Image.LANCZOS)
+            changed = True
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency on white
+            image = image.convert('RGBA')
+            page = Image.new('RGB', image.size, (255, 255, 255))
+            page.paste(image, mask=image.split()[3])
+            image = page
+        if grayscale and image.mode != 'L':
+            image = image.convert('L')
+            changed = True
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        buf = io.BytesIO()
+        image.save(buf, 'JPEG', quality=quality, optimize=True)
+    if not changed and buf.tell() >= len(data):
+        return data, kind
+    return buf.getvalue(), 'jpeg'
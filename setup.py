@@ -1,4 +1,4 @@
-from setuptools import setup
+from setuptools import setup, find_packages
 
 setup(name='comic-scraper',
       version='0.9.0',
@@ -15,7 +15,8 @@ setup(name='comic-scraper',
           'Topic :: Games/Entertainment',
       ],
       keywords='comics manga scraper',
-      packages=['comic_scraper'],
+      packages=find_packages(exclude=['benchmarks']),
+      package_data={'comic_scraper.extractors': ['*.png']},
       install_requires=[
           'beautifulsoup4==4.6.0',
           'certifi==2017.7.27.1',
@@ -28,6 +29,10 @@ setup(name='comic-scraper',
           'requests==2.20.0',
           'urllib3==1.26.5'
       ],
+      extras_require={
+          'fast': ['lxml'],
+          'async': ['aiohttp'],
+      },
       entry_points={
           'console_scripts':
           ['comic-scraper=comic_scraper.comic_scraper:main'],
@@ -0,0 +1,61 @@
+"""Tests of the -c chapter selection grammar and the chapter index."""
+import pytest
+from comic_scraper.base_comic import ChapterIndex, ChapterSelection
+
+
+def make_index(nums):
+    """Index of the given chapter numbers (chapters are (num, url))."""
+    return ChapterIndex(None, lambda comic, num, url: (num, url),
+                        [(num, 'http://host/c%g' % (num)) for num in nums])
+
+
+def test_parse_chapters_and_ranges():
+    selection = ChapterSelection.parse('1, 5,10:20')
+    assert selection.ranges == [(1, 1), (5, 5), (10, 20)]
+    assert selection.latest == 0
+
+
+def test_parse_open_ranges_and_latest():
+    selection = ChapterSelection.parse('10:,:3,last=2,last=5')
+    assert selection.ranges == [(10, None), (None, 3)]
+    assert selection.latest == 5
+
+
+@pytest.mark.parametrize('text', ['', 'ten', '20:10', '1:2:3', 'last=x',
+                                  '1,,2'])
+def test_parse_rejects_bad_input(text):
+    with pytest.raises(SyntaxError):
+        ChapterSelection.parse(text)
+
+
+def test_range():
+    index = make_index([3, 1, 2.5, 10, 7])
+    assert index.range(2, 7) == [2.5, 3, 7]
+    assert index.range(None, 3) == [1, 2.5, 3]
+    assert index.range(7) == [7, 10]
+    assert index.range(11) == []
+
+
+def test_latest():
+    index = make_index([1, 2, 3, 4])
+    assert index.latest(2) == [3, 4]
+    assert index.latest(10) == [1, 2, 3, 4]
+    assert index.latest(0) == []
+
+
+def test_select():
+    index = make_index([1, 2, 3, 4, 5, 6])
+    assert index.select() == [1, 2, 3, 4, 5, 6]
+    assert index.select('1,3:4,last=1') == [1, 3, 4, 6]
+    assert index.select('5:') == [5, 6]
+    # Chapter numbers the index does not have are left out
+    assert index.select(['2', 4, 9]) == [2, 4]
+
+
+def test_add_and_lookup():
+    index = make_index([1, 3])
+    index.add(2, 'http://host/c2')
+    assert list(index) == [1, 2, 3]
+    assert 2 in index and 4 not in index
+    assert index[2] == (2, 'http://host/c2')
+    assert list(index.subset([1, 3])) == [1, 3]
@@ -0,0 +1,52 @@
+"""Tests of the html cache."""
+import pytest
+import requests
+from comic_scraper.http_cache import HttpCache
+
+
+class FakeSession:
+    """Serve one html body per url, counting the requests."""
+
+    def __init__(self, text):
+        """Serve text."""
+        self.text = text
+        self.requests = 0
+
+    def get(self, url, headers=None):
+        """A 200 response with the text (validators are ignored)."""
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = self.text.encode()
+        response.encoding = 'utf-8'
+        return response
+
+
+def test_fresh_response_is_served_from_disk(tmp_path):
+    cache = HttpCache(str(tmp_path), 2 ** 20)
+    session = FakeSession('<html>index</html>')
+    assert cache.fetch(session, 'http://host/a', 60) == '<html>index</html>'
+    assert cache.fetch(session, 'http://host/a', 60) == '<html>index</html>'
+    assert session.requests == 1
+
+
+def test_deferred_keeps_responses_of_a_block_that_succeeds(tmp_path):
+    cache = HttpCache(str(tmp_path), 2 ** 20)
+    session = FakeSession('<html>page</html>')
+    with cache.deferred():
+        cache.fetch(session, 'http://host/a', 60)
+    cache.fetch(session, 'http://host/a', 60)
+    assert session.requests == 1
+
+
+def test_deferred_drops_responses_of_a_block_that_raises(tmp_path):
+    cache = HttpCache(str(tmp_path), 2 ** 20)
+    session = FakeSession('<html>maintenance</html>')
+    with pytest.raises(ValueError):
+        with cache.deferred():
+            cache.fetch(session, 'http://host/a', 60)
+            raise ValueError('did not parse')
+    cache.fetch(session, 'http://host/a', 60)
+    assert session.requests == 2
+    assert cache.size > 0
@@ -0,0 +1,71 @@
+"""Tests of the distributed job queue."""
+import argparse
+import threading
+import time
+from comic_scraper import distributed
+from comic_scraper.job_queue import SqliteQueue
+
+
+def make_queue(tmp_path, pages=2):
+    """A queue with one chapter job, claimed by worker a."""
+    queue = SqliteQueue(str(tmp_path / 'jobs.db'))
+    queue.publish([('chapter', 'comic', 1.0, {'url': 'chapter-1'})])
+    job = queue.claim('a', 60)
+    page_jobs = [('page', 'comic', 1.0, {'page': num})
+                 for num in range(1, pages + 1)]
+    assert queue.complete(job, 'a', 60, page_jobs) is None
+    return queue
+
+
+def test_last_page_hands_over_the_finish_job(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.claim('a', 60)
+    second = queue.claim('b', 60)
+    assert queue.complete(first, 'a', 60) is None
+    finish = queue.complete(second, 'b', 60)
+    assert finish.kind == 'finish' and finish.chapter_num == 1.0
+    # Claimed by the worker completing the last page
+    assert queue.claim('c', 60) is None
+    assert queue.counts() == {'done': 3, 'claimed': 1}
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    queue = make_queue(tmp_path, pages=1)
+    job = queue.claim('a', 0)
+    time.sleep(0.01)
+    assert queue.claim('b', 60).id == job.id
+    # The first worker lost the job
+    assert not queue.renew(job, 'a', 60)
+    assert queue.complete(job, 'a', 60) is None
+
+
+def test_renewed_lease_is_kept(tmp_path):
+    queue = make_queue(tmp_path, pages=1)
+    job = queue.claim('a', 0)
+    assert queue.renew(job, 'a', 60)
+    assert queue.claim('b', 60) is None
+
+
+def test_chapter_retries_are_shared(tmp_path):
+    queue = make_queue(tmp_path)
+    first, second = queue.claim('a', 60), queue.claim('b', 60)
+    assert queue.spend_retry(first, 2)
+    assert queue.spend_retry(second, 2)
+    assert not queue.spend_retry(first, 2)
+
+
+def test_worker_renews_the_leases_of_running_jobs(tmp_path):
+    queue = make_queue(tmp_path, pages=1)
+    worker = distributed.Worker(
+        queue, argparse.Namespace(chapterthreads=1, pagethreads=1),
+        lease=0.3)
+    job = queue.claim(worker.name, worker.lease)
+    worker.running[job.id] = job
+    heartbeat = threading.Thread(target=worker.heartbeat)
+    heartbeat.start()
+    try:
+        time.sleep(0.6)
+        assert queue.claim('b', 60) is None
+    finally:
+        worker.stopped.set()
+        heartbeat.join()
@@ -0,0 +1,28 @@
+"""Tests of the run metrics."""
+from comic_scraper.metrics import Histogram
+
+
+def test_quantiles_are_within_a_bucket():
+    histogram = Histogram()
+    samples = [i / 1000 for i in range(1, 1001)]
+    for seconds in samples:
+        histogram.add(seconds)
+    for q in (0.5, 0.95, 0.99):
+        exact = samples[int(q * len(samples))]
+        assert exact <= histogram.quantile(q) <= exact * Histogram.GROWTH
+
+
+def test_quantile_never_exceeds_the_max():
+    histogram = Histogram()
+    histogram.add(0.0101)
+    assert histogram.quantile(0.5) == 0.0101
+    assert histogram.count == 1 and histogram.max == 0.0101
+
+
+def test_tiny_and_huge_samples_land_in_the_end_buckets():
+    histogram = Histogram()
+    histogram.add(0)
+    histogram.add(10 ** 6)
+    assert histogram.buckets[0] == 1
+    assert histogram.buckets[Histogram.BUCKETS] == 1
+    assert histogram.quantile(0) == Histogram.MIN_SECONDS
@@ -0,0 +1,42 @@
+"""Tests of the retry policy and the blocking retry loop."""
+import pytest
+import requests
+from comic_scraper.base_comic import ParseError, RetryPolicy, retried
+
+
+def http_error(status):
+    """An HTTPError of a response with the given status."""
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+def test_classify():
+    policy = RetryPolicy(3, 1)
+    assert policy.classify(ParseError()) == 'parse'
+    assert policy.classify(http_error(503)) == 'http status'
+    assert policy.classify(http_error(404)) is None
+    assert policy.classify(requests.ConnectionError()) == 'network'
+    assert policy.classify(ValueError()) is None
+
+
+def test_retried_until_success():
+    failures = [http_error(503), ParseError()]
+
+    def scrape():
+        if failures:
+            raise failures.pop(0)
+        return 'index'
+
+    delays = []
+    assert retried(scrape, lambda exc, attempt: delays.append(attempt) or 0) \
+        == 'index'
+    assert delays == [0, 1]
+
+
+def test_retried_gives_up():
+    def scrape():
+        raise http_error(404)
+
+    with pytest.raises(requests.HTTPError):
+        retried(scrape, lambda exc, attempt: None)
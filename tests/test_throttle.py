@@ -0,0 +1,48 @@
+"""Tests of the per-host adaptive limit."""
+import itertools
+from comic_scraper import throttle
+
+
+def release_all(limit, monkeypatch, latencies, step=0.2):
+    """Release one request per latency, step seconds apart."""
+    clock = itertools.count(start=100, step=step)
+    monkeypatch.setattr(throttle.time, 'monotonic', lambda: next(clock))
+    for latency in latencies:
+        limit.acquire()
+        limit.release(True, latency)
+
+
+def test_fast_response_does_not_pin_the_limit(monkeypatch):
+    limit = throttle.AdaptiveLimit(50)
+    release_all(limit, monkeypatch, [0.03] + [0.15] * 200)
+    assert limit.limit == 50
+
+
+def test_slower_responses_halve_the_limit(monkeypatch):
+    limit = throttle.AdaptiveLimit(50)
+    release_all(limit, monkeypatch, [0.15] * 50 + [1.5] * 5)
+    assert limit.limit < 50
+
+
+def test_errors_halve_the_limit_once_per_round_trip(monkeypatch):
+    limit = throttle.AdaptiveLimit(40)
+    monkeypatch.setattr(throttle.time, 'monotonic', lambda: 100)
+    for _ in range(3):
+        limit.acquire()
+        limit.release(False)
+    assert limit.limit == 20
+
+
+def test_try_acquire_waits_out_a_pause_without_blocking(monkeypatch):
+    monkeypatch.setattr(throttle.time, 'monotonic', lambda: 100)
+    host = throttle.HostThrottle(1, rate=1, burst=1)
+    host.pause(5)
+    assert host.try_acquire() == 5
+    monkeypatch.setattr(throttle.time, 'monotonic', lambda: 105)
+    assert host.try_acquire() == 0
+    # The only slot is taken
+    assert host.try_acquire() == throttle.POLL_INTERVAL
+    host.release(None)
+    # The slot is free, but the bucket is empty for another second
+    assert host.try_acquire() == 1
+    assert host.limit.inflight == 0